@@ -1,24 +1,35 @@
 import asyncio
-import discord
-from modules.logger import setup_logger
-from modules.settings_loader import SettingsLoader
-from modules.discord_client import Metatron3
-from modules.avernus_client import AvernusClient
-from modules.twitch_client import TwitchEventSubClient
-
-logger = setup_logger("metatron3.log")
-settings: SettingsLoader = SettingsLoader("configs")
-url: str = settings["avernus"]["ip"]
-port: int = settings["avernus"]["port"]
-avernus_client: AvernusClient = AvernusClient(url, port)
-discord_client: Metatron3 = Metatron3(avernus_client=avernus_client, intents=discord.Intents.all())
-if settings["twitch"]["twitch_enabled"]:
-    twitch_client = TwitchEventSubClient(discord_client=discord_client)
-
-
-async def start_clients():
-    """Spin off clients to threads and start them"""
+
+
+def build_clients(settings):
+    """Builds the avernus and discord clients, and the twitch client if it is enabled"""
+    import discord
+    from modules.discord_client import Metatron3
+    from modules.avernus_client import AvernusClient
+    from modules.twitch_client import TwitchEventSubClient
+
+    url: str = settings["avernus"]["ip"]
+    port: int = settings["avernus"]["port"]
+    avernus_client: AvernusClient = AvernusClient(url,
+                                                   port,
+                                                   max_connections=settings["avernus"].get("max_connections", 20),
+                                                   max_keepalive_connections=settings["avernus"].get("max_keepalive_connections", 10),
+                                                   keepalive_expiry=settings["avernus"].get("keepalive_expiry", 300.0),
+                                                   http2=settings["avernus"].get("http2", False),
+                                                   binary_transport=settings["avernus"].get("binary_transport", False),
+                                                   binary_uploads=settings["avernus"].get("binary_uploads", False),
+                                                   rag_cache_size=settings["avernus"].get("rag_cache_size", 256),
+                                                   rag_cache_ttl=settings["avernus"].get("rag_cache_ttl", 600.0))
+    discord_client: Metatron3 = Metatron3(avernus_client=avernus_client, intents=discord.Intents.all())
+    twitch_client = None
     if settings["twitch"]["twitch_enabled"]:
+        twitch_client = TwitchEventSubClient(discord_client=discord_client)
+    return discord_client, twitch_client
+
+
+async def start_clients(settings, discord_client, twitch_client):
+    """Spin off clients to threads and start them"""
+    if twitch_client is not None:
         await asyncio.gather(
             discord_client.start(settings["discord"]["token"]),  # Start the discord client
             twitch_client.start()
@@ -27,15 +38,23 @@ async def start_clients():
         await asyncio.gather(discord_client.start(settings["discord"]["token"]))
 
 def run_program():
-    """Main startup loop"""
+    """Main startup loop. Nothing is imported or built until here, because card render workers import this module
+    as __mp_main__ when they start and should only load the renderer."""
+    from modules.logger import setup_logger
+    from modules.settings_loader import get_settings
+
+    logger = setup_logger("metatron3.log")
+    settings = get_settings("configs")
+    discord_client, twitch_client = build_clients(settings)
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
     try:
-        loop.run_until_complete(start_clients())
+        loop.run_until_complete(start_clients(settings, discord_client, twitch_client))
     except KeyboardInterrupt:
         logger.info("Metatron3 SHUTDOWN")
     finally:
+        loop.run_until_complete(discord_client.close())
         loop.close()
 
 if __name__ == "__main__":
@@ -5,10 +5,14 @@ import time
 import discord
 from loguru import logger
 from pydub import AudioSegment
-from modules.settings_loader import SettingsLoader
+from modules.queue_buttons import QueuedButtons
+from modules.settings_loader import get_settings
 
 class AceGen:
     """This is the queue object for flux generations"""
+    request_class = "ace"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -16,7 +20,7 @@ class AceGen:
                  user,
                  lyrics,
                  length):
-        self.settings = SettingsLoader("configs")
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -24,6 +28,7 @@ class AceGen:
         self.user = user
         self.lyrics = lyrics
         self.length = length
+        self.affinity_key = ("ace",)
 
     async def run(self):
         start_time = time.time()
@@ -54,6 +59,7 @@ class AceGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             ace_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             ace_logger.info("Ace Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Ace Error: {e}")
@@ -94,9 +100,12 @@ class AceButtons(discord.ui.View):
                                  interaction.user,
                                  self.lyrics,
                                  self.length)
+            size = await self.discord_client.get_queue_position(ace_request)
+            eta = await self.discord_client.get_queue_eta(ace_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True)
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, ace_request))
             ace_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             ace_queuelogger.info("Ace Queued")
             self.discord_client.request_queue_concurrency_list[interaction.user.id] += 1
@@ -1,11 +1,121 @@
+import base64
+import importlib.util
+import json
 import httpx
+from loguru import logger
+from modules.rag_cache import RagCache
+
+IMAGE_FIELDS = ("image", "mask_image", "controlnet_image", "ip_adapter_image")
+
 
 class AvernusClient:
-    """This is the client for the avernus API server"""
-    def __init__(self, url, port=6969):
+    """This is the client for the avernus API server. It owns a single pooled httpx client which is reused by every
+    call so connections are kept alive between generations. Call aclose() on shutdown to release the pool.
+
+    Image calls ask for a multipart response of raw images when binary_transport is on, and return a list of bytes
+    if the server sends one or the usual list of base64 strings if it answers with JSON. With binary_uploads on, input
+    images given as bytes are sent as multipart form files instead of base64 in the JSON body. If the server rejects
+    that, uploads fall back to base64 for the rest of the session. Sent and received payload sizes are kept per
+    transport in payload_stats.
+
+    RAG results are cached in rag_cache, keyed on the normalized prompt and retrieval settings."""
+    def __init__(self, url, port=6969, max_connections=20, max_keepalive_connections=10, keepalive_expiry=300.0,
+                 http2=False, binary_transport=False, binary_uploads=False, rag_cache_size=256, rag_cache_ttl=600.0):
         self.url = url
         self.port = port
         self.base_url = f"{self.url}:{self.port}"
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.http2 = http2
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+            self.http2 = False
+        self.client = self.build_client()
+        self.binary_transport = binary_transport
+        self.binary_uploads = binary_uploads
+        self.payload_stats = {}
+        self.rag_cache = RagCache(max_entries=rag_cache_size, ttl=rag_cache_ttl)
+
+    def build_client(self):
+        """Builds the pooled httpx client. Avernus is plain http so HTTP/2 uses prior knowledge (h2c) when enabled."""
+        return httpx.AsyncClient(limits=self.limits,
+                                 http1=not self.http2,
+                                 http2=self.http2,
+                                 timeout=3600.0)
+
+    async def aclose(self):
+        """Closes the pooled client and any kept alive connections"""
+        if not self.client.is_closed:
+            await self.client.aclose()
+
+    async def post_images(self, url, data, timeout=3600):
+        """Posts an image generation request, sending any bytes input images as multipart files when binary uploads
+        are enabled and as base64 otherwise"""
+        headers = {"Accept": "multipart/mixed, application/json;q=0.9"} if self.binary_transport else None
+        image_fields = [field for field in IMAGE_FIELDS if isinstance(data.get(field), bytes)]
+        if image_fields and self.binary_uploads:
+            params = {key: value for key, value in data.items() if key not in image_fields}
+            files = {field: (f"{field}.png", data[field], "image/png") for field in image_fields}
+            response = await self.client.post(url, data={"json": json.dumps(params)}, files=files, headers=headers,
+                                              timeout=timeout)
+            if response.status_code not in (415, 422):
+                self.record_payload("multipart", response)
+                return response
+            logger.bind(status=response.status_code).warning("Avernus Binary Uploads Unsupported")
+            self.binary_uploads = False
+        if image_fields:
+            data = {**data, **{field: base64.b64encode(data[field]).decode("utf-8") for field in image_fields}}
+        response = await self.client.post(url, json=data, headers=headers, timeout=timeout)
+        self.record_payload("json", response)
+        return response
+
+    def read_images(self, response):
+        """Returns the images in a response, as raw bytes for a multipart response or base64 strings for JSON"""
+        content_type = response.headers.get("content-type", "")
+        if content_type.startswith("multipart/"):
+            return self.parse_multipart(response.content, content_type)
+        return response.json().get("images", [])
+
+    @staticmethod
+    def parse_multipart(body, content_type):
+        """Splits a multipart body into the raw content of each part"""
+        boundary = None
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "boundary":
+                boundary = value.strip('"').encode("utf-8")
+        if boundary is None:
+            raise ValueError("Multipart response without a boundary")
+        delimiter = b"--" + boundary
+        parts = []
+        position = body.find(delimiter)
+        while position != -1:
+            position += len(delimiter)
+            if body[position:position + 2] == b"--":
+                break
+            headers_end = body.find(b"\r\n\r\n", position)
+            next_position = body.find(b"\r\n" + delimiter, headers_end)
+            if headers_end == -1 or next_position == -1:
+                raise ValueError("Malformed multipart response")
+            parts.append(body[headers_end + 4:next_position])
+            position = next_position + 2
+        return parts
+
+    def record_payload(self, upload_transport, response):
+        """Adds the size of a request and its response to the payload stats, keyed by how the request was uploaded
+        and how the response came back"""
+        download_transport = "multipart" if response.headers.get("content-type", "").startswith("multipart/") else "json"
+        bytes_sent = int(response.request.headers.get("content-length", 0))
+        bytes_received = len(response.content)
+        stats = self.payload_stats.setdefault(f"{upload_transport}/{download_transport}",
+                                              {"requests": 0, "bytes_sent": 0, "bytes_received": 0})
+        stats["requests"] += 1
+        stats["bytes_sent"] += bytes_sent
+        stats["bytes_received"] += bytes_received
+        payload_logger = logger.bind(upload=upload_transport, download=download_transport, sent=bytes_sent,
+                                     received=bytes_received)
+        payload_logger.debug("Avernus Payload")
 
     async def ace_music(self, prompt, lyrics, audio_duration=None, guidance_scale=None, infer_step=None,
                         omega_scale=None, actual_seeds=None):
@@ -20,8 +130,7 @@ class AvernusClient:
                 "actual_seeds": actual_seeds}
 
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.client.post(url, json=data, timeout=3600)
             if response.status_code == 200:
                 # Save the returned binary video content
                 #with open("output.wav", "wb") as f:
@@ -39,8 +148,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/status"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -68,10 +176,9 @@ class AvernusClient:
                 "strength": strength,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"FLUX FILL ERROR: {response.status_code}")
         except Exception as e:
@@ -97,10 +204,9 @@ class AvernusClient:
                 "seed": seed,
                 "guidance_scale": guidance_scale}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"FLUX ERROR: {response.status_code}")
         except Exception as e:
@@ -125,10 +231,9 @@ class AvernusClient:
                 "strength": strength,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"FLUX INPAINT ERROR: {response.status_code}")
         except Exception as e:
@@ -155,10 +260,9 @@ class AvernusClient:
                 "seed": seed,
                 "guidance_scale": guidance_scale}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"FLUX KONTEXT ERROR: {response.status_code}")
         except Exception as e:
@@ -170,8 +274,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/list_flux_loras"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json().get("loras", [])
             else:
@@ -186,8 +289,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/list_qwen_image_loras"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json().get("loras", [])
             else:
@@ -202,8 +304,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/list_sdxl_controlnets"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json().get("sdxl_controlnets", [])
             else:
@@ -218,8 +319,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/list_sdxl_loras"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json().get("loras", [])
             else:
@@ -234,8 +334,7 @@ class AvernusClient:
         url = f"http://{self.base_url}/list_sdxl_schedulers"
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url)
+            response = await self.client.get(url, timeout=30.0)
             if response.status_code == 200:
                 return response.json().get("schedulers", [])
             else:
@@ -251,8 +350,7 @@ class AvernusClient:
         data = {"prompt": prompt, "model_name": model_name, "messages": messages}
 
         try:
-            async with httpx.AsyncClient(timeout=3600.0) as client:
-                response = await client.post(url, json=data)
+            response = await self.client.post(url, json=data, timeout=3600.0)
             if response.status_code == 200:
                 return response.json().get("response", "")
             else:
@@ -262,6 +360,51 @@ class AvernusClient:
             print(f"EXCEPTION ERROR: {e}")
             return {"ERROR": str(e)}
 
+    async def llm_chat_stream(self, prompt, model_name=None, messages=None):
+        """This takes a prompt, and optionally a model name and chat history, then yields the response as it is
+        generated. Server sent events and plain chunked text are both understood, and if the server answers with a
+        normal JSON response the whole response is yielded at once."""
+        url = f"http://{self.base_url}/llm_chat"
+        data = {"prompt": prompt, "model_name": model_name, "messages": messages, "stream": True}
+        headers = {"Accept": "text/event-stream, application/json;q=0.9"}
+
+        async with self.client.stream("POST", url, json=data, headers=headers, timeout=3600.0) as response:
+            if response.status_code != 200:
+                await response.aread()
+                print(f"LLM ERROR: {response.status_code}, Response: {response.text}")
+                raise RuntimeError(f"LLM ERROR: {response.status_code}")
+            content_type = response.headers.get("content-type", "")
+            if content_type.startswith("application/json"):
+                await response.aread()
+                yield response.json().get("response", "")
+            elif content_type.startswith("text/event-stream"):
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    event_data = line[5:]
+                    if event_data.startswith(" "):
+                        event_data = event_data[1:]
+                    if event_data.strip() == "[DONE]":
+                        break
+                    yield self.parse_stream_event(event_data)
+            else:
+                async for chunk in response.aiter_text():
+                    yield chunk
+
+    @staticmethod
+    def parse_stream_event(event_data):
+        """Returns the text in a server sent event, which is either a JSON object with the new text or the text itself"""
+        try:
+            event = json.loads(event_data)
+        except json.JSONDecodeError:
+            return event_data
+        if isinstance(event, dict):
+            for key in ("response", "token", "text", "content"):
+                if isinstance(event.get(key), str):
+                    return event[key]
+            return ""
+        return event if isinstance(event, str) else event_data
+
     async def ltx_video(self, prompt, video=None):
         """This takes a prompt and optiional video and returns a video"""
         url = f"http://{self.base_url}/ltx_generate"
@@ -271,11 +414,10 @@ class AvernusClient:
         data = {"prompt": prompt}
 
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                if files:
-                    response = await client.post(url, data=data, files=files)
-                else:
-                    response = await client.post(url, data=data)
+            if files:
+                response = await self.client.post(url, data=data, files=files, timeout=3600)
+            else:
+                response = await self.client.post(url, data=data, timeout=3600)
             if response.status_code == 200:
                 # Save the returned binary video content
                 with open("output.mp4", "wb") as f:
@@ -294,8 +436,7 @@ class AvernusClient:
         data = {"prompt": prompt, "model_name": model_name, "messages": messages}
 
         try:
-            async with httpx.AsyncClient(timeout=3600.0) as client:
-                response = await client.post(url, json=data)
+            response = await self.client.post(url, json=data, timeout=3600.0)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -323,10 +464,9 @@ class AvernusClient:
                 "seed": seed,
                 "true_cfg_scale": true_cfg_scale}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"FLUX ERROR: {response.status_code}")
         except Exception as e:
@@ -352,10 +492,9 @@ class AvernusClient:
                 "strength": strength,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"QWEN IMAGE INPAINT ERROR: {response.status_code}")
         except Exception as e:
@@ -378,10 +517,9 @@ class AvernusClient:
                 "seed": seed,
                 "true_cfg_scale": true_cfg_scale}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"QWEN IMAGE EDIT ERROR: {response.status_code}")
         except Exception as e:
@@ -389,15 +527,22 @@ class AvernusClient:
             return {"ERROR": str(e)}
 
     async def rag_retrieve(self, prompt, max_candidates=20, similarity_threshold=0.6):
-        """This takes a prompt and optionally a number of results, and then returns the mathing RAG documents"""
+        """This takes a prompt and optionally a number of results, and then returns the mathing RAG documents.
+        Successful results are served from the RAG cache until they expire."""
         url = f"http://{self.base_url}/rag_retrieve"
         data = {"prompt": prompt, "max_candidates": max_candidates, "similarity_threshold": similarity_threshold}
+        cache_key = self.rag_cache.make_key(prompt, max_candidates, similarity_threshold)
+        cached_results = self.rag_cache.get(cache_key)
+        if cached_results is not None:
+            return list(cached_results)
 
         try:
-            async with httpx.AsyncClient(timeout=3600.0) as client:
-                response = await client.post(url, json=data)
+            response = await self.client.post(url, json=data, timeout=3600.0)
             if response.status_code == 200:
-                return response.json().get("response", "")
+                results = response.json().get("response", "")
+                if isinstance(results, list):
+                    self.rag_cache.put(cache_key, tuple(results))
+                return results
             else:
                 print(f"RAG ERROR: {response.status_code}, Response: {response.text}")
                 return {"RAG ERROR": response.text}
@@ -430,10 +575,9 @@ class AvernusClient:
                 "scheduler": scheduler,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"SDXL ERROR: {response.status_code}")
         except Exception as e:
@@ -460,10 +604,9 @@ class AvernusClient:
                 "scheduler": scheduler,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                response = await client.post(url, json=data)
+            response = await self.post_images(url, data)
             if response.status_code == 200:
-                return response.json().get("images", [])
+                return self.read_images(response)
             else:
                 print(f"SDXL INPAINT ERROR: {response.status_code}")
         except Exception as e:
@@ -485,11 +628,10 @@ class AvernusClient:
                 "guidance_scale": guidance_scale,
                 "seed": seed}
         try:
-            async with httpx.AsyncClient(timeout=3600) as client:
-                if files:
-                    response = await client.post(url, data=data, files=files)
-                else:
-                    response = await client.post(url, data=data)
+            if files:
+                response = await self.client.post(url, data=data, files=files, timeout=3600)
+            else:
+                response = await self.client.post(url, data=data, timeout=3600)
             if response.status_code == 200:
                 # Save the returned binary video content
                 with open("wan_client_output.mp4", "wb") as f:
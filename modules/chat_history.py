@@ -0,0 +1,96 @@
+import asyncio
+from loguru import logger
+
+
+def estimate_tokens(text):
+    """Roughly estimates how many tokens a message uses, at about four characters per token plus message framing"""
+    return len(text) // 4 + 4
+
+
+class ChatHistory:
+    """Keeps each users chat history inside a token budget. Only the newest messages that fit in the budget are sent
+    with a prompt. Once a users stored history goes over the budget, the oldest messages are folded into a rolling
+    summary in the background. The summary is sent ahead of the recent messages, so the prompt size stays bounded
+    without forgetting the whole conversation. Going over max_messages stored messages folds them the same way, so
+    the stored history stays bounded even with a large token budget."""
+    def __init__(self, user_store, avernus_client, token_budget=2000, max_messages=20):
+        self.user_store = user_store
+        self.avernus_client = avernus_client
+        self.token_budget: int = token_budget
+        self.max_messages: int = max_messages
+        self.summary_tasks: dict = {}
+
+    @staticmethod
+    def row_tokens(row):
+        """Returns the stored token count for a history row, estimating it for rows imported without one"""
+        _, _, content, tokens = row
+        return tokens or estimate_tokens(content)
+
+    async def get_messages(self, user_id):
+        """Returns the summary and the newest messages that fit in the token budget, or None if there is no history"""
+        rows = await self.user_store.get_history_rows(user_id)
+        summary = await self.user_store.get_user_setting(user_id, "history_summary")
+        budget = self.token_budget
+        if summary:
+            budget -= estimate_tokens(summary)
+        messages = []
+        for row in reversed(rows):
+            tokens = self.row_tokens(row)
+            if tokens > budget:
+                break
+            messages.append({"role": row[1], "content": row[2]})
+            budget -= tokens
+        messages.reverse()
+        if summary:
+            messages.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        return messages or None
+
+    async def add_message(self, user_id, role, content):
+        await self.user_store.add_history(user_id, role, content, estimate_tokens(content))
+
+    async def clear(self, user_id):
+        await self.user_store.clear_history(user_id)
+        await self.user_store.set_user_setting(user_id, "history_summary", None)
+
+    def schedule_summary(self, user_id, model_name):
+        """Starts a background summary of the users oldest messages if one is not already running"""
+        if user_id in self.summary_tasks:
+            return
+        task = asyncio.create_task(self.summarize(user_id, model_name))
+        self.summary_tasks[user_id] = task
+        task.add_done_callback(lambda _: self.summary_tasks.pop(user_id, None))
+
+    async def summarize(self, user_id, model_name):
+        """Folds the oldest messages into the summary until the remaining history fits in half the token budget and
+        half of max_messages"""
+        try:
+            rows = await self.user_store.get_history_rows(user_id)
+            if sum(self.row_tokens(row) for row in rows) <= self.token_budget and len(rows) <= self.max_messages:
+                return
+            kept_tokens = 0
+            split = len(rows)
+            while (split > 0 and len(rows) - split < self.max_messages // 2 and
+                   kept_tokens + self.row_tokens(rows[split - 1]) <= self.token_budget // 2):
+                split -= 1
+                kept_tokens += self.row_tokens(rows[split])
+            folded_rows = rows[:split]
+            if not folded_rows:
+                return
+            summary = await self.user_store.get_user_setting(user_id, "history_summary")
+            conversation = "\n".join(f"{role}: {content}" for _, role, content, _ in folded_rows)
+            summary_prompt = ("Summarize the following conversation in a short paragraph, keeping names, facts and "
+                              "anything the user asked to be remembered. You respond with ONLY the summary.")
+            if summary:
+                summary_prompt += f"\nSummary of the conversation before this: {summary}"
+            summary_prompt += f"\nConversation:\n{conversation}"
+            new_summary = await self.avernus_client.llm_chat(summary_prompt, model_name)
+            if not isinstance(new_summary, str) or not new_summary.strip():
+                logger.bind(user=user_id, response=new_summary).warning("History Summary Failed")
+                return
+            if await self.user_store.delete_history_through(user_id, folded_rows[-1][0]) == 0:
+                return  # the history was cleared while the summary was generated
+            await self.user_store.set_user_setting(user_id, "history_summary", new_summary.strip())
+            summary_logger = logger.bind(user=user_id, folded=len(folded_rows), kept=len(rows) - split)
+            summary_logger.info("History Summarized")
+        except Exception as e:
+            logger.bind(user=user_id).error(f"HISTORY SUMMARY ERROR: {e}")
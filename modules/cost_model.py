@@ -0,0 +1,73 @@
+import json
+import os
+import time
+from loguru import logger
+from modules.request_scheduler import DEFAULT_CLASS_COSTS, estimate_cost, get_request_class, get_work_units
+
+
+class CostModel:
+    """Learns how long each pipeline takes from finished requests. Latency is tracked as seconds per work unit, where a
+    work unit scales with resolution, batch size and audio duration (see get_work_units), as an exponentially
+    weighted average per pipeline (the queue object class, e.g. SDXLGenEnhanced) and per request class. Pipelines that
+    have not run yet use their request class average, and classes that have not run yet use request_class_costs.
+
+    The averages are saved to disk every save_interval seconds and on shutdown so estimates survive restarts."""
+    def __init__(self, path="configs/cache/cost_model.json", class_costs=None, alpha=0.2, save_interval=60.0):
+        self.path: str = path
+        self.class_costs: dict = {**DEFAULT_CLASS_COSTS, **(class_costs or {})}
+        self.alpha: float = alpha
+        self.save_interval: float = save_interval
+        self.pipelines: dict = {}
+        self.classes: dict = {}
+        self.last_saved: float = time.monotonic()
+        self.dirty: bool = False
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            logger.bind(path=self.path).warning(f"Cost Model Unreadable: {e}")
+            return
+        if isinstance(data, dict):
+            self.pipelines = data.get("pipelines", {})
+            self.classes = data.get("classes", {})
+
+    def snapshot(self):
+        """Returns the learned averages as JSON, taken on the event loop so a save in another thread never sees them
+        change halfway through"""
+        self.dirty = False
+        self.last_saved = time.monotonic()
+        return json.dumps({"pipelines": self.pipelines, "classes": self.classes}, indent=2)
+
+    def write(self, snapshot):
+        """Writes a snapshot to disk, replacing the old file atomically"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(snapshot)
+        os.replace(temp_path, self.path)
+
+    def due_for_save(self):
+        return self.dirty and time.monotonic() - self.last_saved >= self.save_interval
+
+    def estimate(self, request):
+        """Returns the expected run time of a queue object in seconds"""
+        stats = self.pipelines.get(type(request).__name__) or self.classes.get(get_request_class(request))
+        if stats is None:
+            return estimate_cost(request, self.class_costs)
+        return stats["seconds_per_unit"] * get_work_units(request)
+
+    def record(self, request, elapsed_time):
+        """Folds the run time of a finished queue object into its pipeline and request class averages"""
+        seconds_per_unit = elapsed_time / get_work_units(request)
+        for table, key in ((self.pipelines, type(request).__name__), (self.classes, get_request_class(request))):
+            stats = table.get(key)
+            if stats is None:
+                table[key] = {"seconds_per_unit": seconds_per_unit, "samples": 1}
+            else:
+                stats["seconds_per_unit"] += self.alpha * (seconds_per_unit - stats["seconds_per_unit"])
+                stats["samples"] += 1
+        self.dirty = True
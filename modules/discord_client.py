@@ -1,13 +1,17 @@
 import asyncio
+import hashlib
 import json
-import os
 import re
+import time
 import discord
 from typing import Optional
 from loguru import logger
 
 from modules.qwen_image import QwenImageGenEnhanced
-from modules.settings_loader import SettingsLoader
+from modules.queue_buttons import QueuedButtons
+from modules.settings_loader import SettingsLoader, get_settings
+from modules.user_store import UserStore
+from modules.chat_history import ChatHistory
 from modules.avernus_client import AvernusClient
 from modules.llm_chat import LlmChat, LlmChatClear
 from modules.mtg_card import MTGCardGen, MTGCardGenThreePack, MTGCardGenFlux, MTGCardGenFluxThreePack
@@ -15,6 +19,21 @@ from modules.sdxl import SDXLGen, SDXLGenEnhanced
 from modules.flux import FluxGen, FluxGenEnhanced, FluxKontextGen
 from modules.ace import AceGen
 from modules.qwen_image import QwenImageGen, QwenImageGenEnhanced, QwenImageEditGen
+from modules.request_scheduler import RequestScheduler
+from modules.image_batcher import ImageBatcher
+from modules.image_codec import ImageCodec
+from modules.guild_icon_cache import GuildIconCache
+from modules.prompt_enhancer import PromptEnhancer
+from modules.startup_cache import StartupCache
+from modules.cost_model import CostModel
+from modules.job_journal import JobJournal, JournalAttachment
+from modules.mtg_card_renderer import CardRenderer
+
+
+JOB_TYPES = {job_class.__name__: job_class for job_class in (
+    LlmChat, LlmChatClear, MTGCardGen, MTGCardGenThreePack, MTGCardGenFlux, MTGCardGenFluxThreePack, SDXLGen,
+    SDXLGenEnhanced, FluxGen, FluxGenEnhanced, FluxKontextGen, AceGen, QwenImageGen, QwenImageGenEnhanced,
+    QwenImageEditGen)}
 
 
 # noinspection PyUnresolvedReferences
@@ -24,25 +43,83 @@ class Metatron3(discord.Client):
         super().__init__(intents=intents)
         self.avernus_client: AvernusClient = avernus_client
         self.slash_commands: discord.app_commands.CommandTree = discord.app_commands.CommandTree(self)
-        self.settings: SettingsLoader = SettingsLoader("configs")
-        self.request_queue: asyncio.Queue = asyncio.Queue()
+        self.settings: SettingsLoader = get_settings("configs")
+        self.cost_model: CostModel = CostModel(class_costs=self.settings["discord"].get("request_class_costs", {}))
+        self.job_journal: JobJournal = JobJournal()
+        self.journaled_jobs: list = []
+        self.journal_replayed: bool = False
+        self.request_queue: RequestScheduler = RequestScheduler(
+            workers=self.settings["discord"].get("request_workers", 6),
+            class_limits=self.settings["discord"].get("request_class_limits", {}),
+            on_request_done=self.request_done,
+            affinity_window=self.settings["discord"].get("affinity_window", 5),
+            affinity_max_skips=self.settings["discord"].get("affinity_max_skips", 3),
+            max_batch_size=self.settings["discord"].get("max_batch_size", 10),
+            class_costs=self.settings["discord"].get("request_class_costs", {}),
+            cost_model=self.cost_model,
+            journal=self.job_journal,
+            share_window=self.settings["discord"].get("seeded_result_ttl", 60.0))
+        self.card_renderer: CardRenderer = CardRenderer(
+            max_workers=self.settings["discord"].get("card_render_workers", 3))
+        self.guild_icon_cache: GuildIconCache = GuildIconCache()
+        self.user_store: UserStore = UserStore()
+        self.chat_history: ChatHistory = ChatHistory(
+            self.user_store,
+            self.avernus_client,
+            token_budget=self.settings["discord"].get("history_token_budget", 2000),
+            max_messages=self.settings["discord"].get("max_user_history_messages", 20))
+        self.prompt_enhancer: PromptEnhancer = PromptEnhancer(
+            self.avernus_client,
+            max_entries=self.settings["discord"].get("prompt_enhancement_cache_size", 128))
+        self.image_codec: ImageCodec = ImageCodec(
+            max_workers=self.settings["discord"].get("image_codec_workers", 4))
+        self.image_batcher: ImageBatcher = ImageBatcher(
+            self.avernus_client,
+            window=self.settings["discord"].get("image_batch_window", 0.05),
+            max_batch_size=self.settings["discord"].get("max_batch_size", 10),
+            result_ttl=self.settings["discord"].get("seeded_result_ttl", 60.0))
         self.request_queue_concurrency_list: dict = {}
-        self.request_currently_processing: bool = False
         self.allowed_mentions: discord.AllowedMentions = discord.AllowedMentions(everyone=False, replied_user=True, users=True)
         self.sd_xl_models_choices: list = []
         self.sd_xl_loras_choices: list = []
         self.sd_xl_controlnet_choices: list = []
         self.flux_loras_choices: list = []
         self.qwen_image_loras_choices: list = []
+        self.startup_cache: StartupCache = StartupCache()
+        self.startup_cache_data: dict = {}
+        self.slash_commands_lock: asyncio.Lock = asyncio.Lock()
+        self.discovery_task: Optional[asyncio.Task] = None
 
     async def setup_hook(self):
-        """This loads the various shit before logging in to discord"""
-        avernus_status = await self.avernus_client.check_status()
+        """This loads the various shit before logging in to discord. The avernus status check, user store and choice
+        discovery are independent so they run at the same time."""
+        start_time = time.perf_counter()
+        avernus_status, _, _, _, _ = await asyncio.gather(self.avernus_client.check_status(),
+                                                          self.user_store.start(),
+                                                          self.build_discord_choices(),
+                                                          asyncio.to_thread(self.cost_model.load),
+                                                          self.job_journal.start())
+        await self.restore_journaled_jobs()
         avernus_status_logger = logger.bind(status=avernus_status)
         avernus_status_logger.info("Avernus")
-        await self.build_discord_choices()
-        self.loop.create_task(self.process_request_queue())
+        self.request_queue.start()
+        self.card_renderer.start()
         await self.register_slash_commands()
+        setup_logger = logger.bind(seconds=f"{time.perf_counter() - start_time:.2f}")
+        setup_logger.info("Setup Complete")
+
+    async def close(self):
+        """Closes the discord connection and then releases the pooled avernus connections and worker pools"""
+        if self.discovery_task is not None:
+            self.discovery_task.cancel()
+        await super().close()
+        await self.avernus_client.aclose()
+        if self.cost_model.dirty:
+            await asyncio.to_thread(self.cost_model.write, self.cost_model.snapshot())
+        self.card_renderer.shutdown()
+        self.image_codec.shutdown()
+        await self.user_store.close()
+        await self.job_journal.close()
 
     async def on_message(self, message):
         """This captures people talking to the bot in chat and responds."""
@@ -59,25 +136,67 @@ class Metatron3(discord.Client):
                     await message.channel.send("Queue limit has been reached, please wait for your previous gens to finish")
 
     async def on_ready(self):
-        """Prints the bots name to discord and syncs the slash commands"""
-        await self.slash_commands.sync()
+        """Prints the bots name to discord and syncs the slash commands if they changed"""
+        await self.sync_slash_commands()
         on_ready_logger = logger.bind(user=self.user.name, userid=self.user.id)
         on_ready_logger.info("Discord Login Success")
-
-    async def process_request_queue(self):
-        """Processes the request queue objects"""
-        while True:
-            queue_request = await self.request_queue.get()
+        if not self.journal_replayed:
+            self.journal_replayed = True
+            await self.replay_journaled_jobs()
+
+    async def restore_journaled_jobs(self):
+        """Loads the jobs left unfinished by the last run and counts them against their users queue limits straight
+        away, so nobody can queue past their limit before the jobs are replayed"""
+        max_age = self.settings["discord"].get("job_replay_max_age", 86400)
+        for job in await self.job_journal.pending_jobs():
+            if time.time() - job["created_at"] > max_age:
+                await self.job_journal.discard(job["id"])
+                continue
+            self.journaled_jobs.append(job)
+            self.request_queue_concurrency_list.setdefault(job["user_id"], 0)
+            self.request_queue_concurrency_list[job["user_id"]] += 1
+
+    async def replay_journaled_jobs(self):
+        """Rebuilds the restored jobs into queue objects and queues them again in their original order"""
+        replayed = 0
+        for job in self.journaled_jobs:
             try:
-                self.request_currently_processing = True
-                await queue_request.run()
+                queue_request = await self.rehydrate_job(job)
             except Exception as e:
-                self.request_queue_concurrency_list[queue_request.user.id] -= 1
-                logger.error(f"Exception: {e}")
-            finally:
-                self.request_queue_concurrency_list[queue_request.user.id] -= 1
-                self.request_queue.task_done()
-                self.request_currently_processing = False
+                logger.bind(job_type=job["job_type"], job_id=job["id"]).warning(f"Job Replay Failed: {e}")
+                queue_request = None
+            if queue_request is None:
+                self.request_queue_concurrency_list[job["user_id"]] -= 1
+                await self.job_journal.discard(job["id"])
+                continue
+            queue_request.job_id = job["id"]
+            await self.request_queue.put(queue_request)
+            replayed += 1
+        if self.journaled_jobs:
+            logger.bind(replayed=replayed, dropped=len(self.journaled_jobs) - replayed).info("Jobs Replayed")
+        self.journaled_jobs = []
+
+    async def rehydrate_job(self, job):
+        """Builds the queue object for a job record, or returns None if its type or channel no longer exist"""
+        job_class = JOB_TYPES.get(job["job_type"])
+        if job_class is None:
+            return None
+        channel = self.get_channel(job["channel_id"]) or await self.fetch_channel(job["channel_id"])
+        if job["user_name"] is not None:
+            from modules.twitch_client import CustomDiscordUser
+            user = CustomDiscordUser(job["user_name"])
+        else:
+            user = self.get_user(job["user_id"]) or await self.fetch_user(job["user_id"])
+        params = {}
+        for name, value in job["params"].items():
+            if isinstance(value, dict) and "attachment_url" in value:
+                value = JournalAttachment(self, value["attachment_url"], value.get("filename"))
+            params[name] = value
+        return job_class(self, channel=channel, user=user, **params)
+
+    def request_done(self, queue_request):
+        """Called by the request scheduler when a queue object has finished running"""
+        self.request_queue_concurrency_list[queue_request.user.id] -= 1
 
     async def is_room_in_queue(self, user_id):
         """This checks the users current number of pending gens against the max,
@@ -85,56 +204,112 @@ class Metatron3(discord.Client):
         if await self.is_user_banned(user_id):
             return False
         self.request_queue_concurrency_list.setdefault(user_id, 0)
-        user_queue_depth = self.settings["discord"]["max_user_queue"]
+        user_queue_depth = get_settings("configs")["discord"]["max_user_queue"]
         if self.request_queue_concurrency_list[user_id] >= user_queue_depth:
             return False
         return True
 
-    async def get_queue_depth(self):
-        if self.request_currently_processing is True:
-            size = int(self.request_queue.qsize()) + 1
-        else:
-            size = int(self.request_queue.qsize())
-        return size
+    async def get_queue_position(self, queue_request):
+        """Returns how many requests of the same type would run before this one under the fair share order"""
+        return self.request_queue.position(queue_request)
 
-    @staticmethod
-    async def is_user_banned(user_id):
-        """Checks the users config if they are banned and returns true if they are, else false"""
-        file_path = f"configs/users/{user_id}.json"
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                try:
-                    user_data = json.load(file)
-                    return user_data.get("banned", False)  # Default to False if key is missing
-                except json.JSONDecodeError:  # Handle empty or corrupted files
-                    return False
-        return False  # Return False if file doesn't exist
+    async def get_queue_eta(self, queue_request):
+        """Returns the estimated time until a request would be finished if it were queued now, formatted for discord"""
+        seconds = round(self.request_queue.estimate_wait(queue_request))
+        if seconds < 60:
+            return f"~{seconds}s"
+        return f"~{seconds // 60}m {seconds % 60:02d}s"
 
-    async def build_discord_choices(self):
-        sd_xl_loras_list = await self.avernus_client.list_sdxl_loras()  # get the list of available loras to build the interface with
-        for lora in sd_xl_loras_list:
-            self.sd_xl_loras_choices.append(discord.app_commands.Choice(name=lora, value=lora))
-
-        sd_xl_controlnets_list = await self.avernus_client.list_sdxl_controlnets()
-        for controlnet in sd_xl_controlnets_list:
-            self.sd_xl_controlnet_choices.append(discord.app_commands.Choice(name=controlnet, value=controlnet))
-
-        flux_loras_list = await self.avernus_client.list_flux_loras()  # get the list of available loras to build the interface with
-        for lora in flux_loras_list:
-            self.flux_loras_choices.append(discord.app_commands.Choice(name=lora, value=lora))
-
-        qwen_image_loras_list = await self.avernus_client.list_qwen_image_loras()  # get the list of available loras to build the interface with
-        for lora in qwen_image_loras_list:
-            self.qwen_image_loras_choices.append(discord.app_commands.Choice(name=lora, value=lora))
+    async def is_user_banned(self, user_id):
+        """Checks the in memory ban set and returns true if they are banned, else false"""
+        return self.user_store.is_banned(user_id)
 
+    async def build_discord_choices(self):
+        """Fills the model, lora and controlnet choices. If a previous start cached the avernus lists on disk, those are
+        used straight away and refreshed in the background, otherwise startup waits for avernus."""
+        self.startup_cache_data = await asyncio.to_thread(self.startup_cache.load)
         for model in self.settings["avernus"]["sdxl_models_list"]:
             self.sd_xl_models_choices.append(discord.app_commands.Choice(name=model, value=model))
+        cached_choices = self.startup_cache_data.get("choices")
+        if cached_choices:
+            self.set_discord_choices(cached_choices)
+            self.discovery_task = asyncio.create_task(self.refresh_discord_choices())
+        else:
+            await self.refresh_discord_choices()
+
+    def get_discovery_targets(self):
+        """Returns the avernus call and the choice list to fill for each discovered list"""
+        return {"sdxl_loras": (self.avernus_client.list_sdxl_loras, self.sd_xl_loras_choices),
+                "sdxl_controlnets": (self.avernus_client.list_sdxl_controlnets, self.sd_xl_controlnet_choices),
+                "flux_loras": (self.avernus_client.list_flux_loras, self.flux_loras_choices),
+                "qwen_image_loras": (self.avernus_client.list_qwen_image_loras, self.qwen_image_loras_choices)}
+
+    def set_discord_choices(self, choices):
+        """Replaces the contents of each choice list in place, so commands already registered see the new choices"""
+        for name, (_, choice_list) in self.get_discovery_targets().items():
+            choice_list[:] = [discord.app_commands.Choice(name=value, value=value) for value in choices.get(name, [])]
+
+    async def refresh_discord_choices(self):
+        """Fetches every list from avernus concurrently, keeping the cached list for any call that fails or times out.
+        Changed lists are cached to disk and, once connected, synced to discord."""
+        timeout = self.settings["discord"].get("discovery_timeout", 10.0)
+        targets = self.get_discovery_targets()
+        results = await asyncio.gather(*(self.discover(name, call, timeout) for name, (call, _) in targets.items()))
+        cached_choices = self.startup_cache_data.get("choices", {})
+        choices = dict(cached_choices)
+        for name, result in zip(targets, results):
+            if result is not None:
+                choices[name] = result
+        self.set_discord_choices(choices)
+        if choices != cached_choices:
+            self.startup_cache_data["choices"] = choices
+            await asyncio.to_thread(self.startup_cache.save, dict(self.startup_cache_data))
+            if self.is_ready():
+                await self.sync_slash_commands()
+
+    @staticmethod
+    async def discover(name, call, timeout):
+        """Runs one avernus discovery call, returning None if it failed or took longer than timeout seconds"""
+        try:
+            result = await asyncio.wait_for(call(), timeout)
+        except asyncio.TimeoutError:
+            logger.bind(call=name, timeout=timeout).warning("Avernus Discovery Timeout")
+            return None
+        if not isinstance(result, list):
+            logger.bind(call=name, response=result).warning("Avernus Discovery Failed")
+            return None
+        return result
+
+    def get_command_tree_hash(self):
+        commands = [command.to_dict(self.slash_commands) for command in self.slash_commands.get_commands()]
+        tree = json.dumps([self.application_id, commands], sort_keys=True, default=str)
+        return hashlib.sha256(tree.encode("utf-8")).hexdigest()
+
+    async def sync_slash_commands(self):
+        """Syncs the slash commands with discord, skipping the sync if the command tree is the same as the last one
+        synced"""
+        async with self.slash_commands_lock:
+            tree_hash = self.get_command_tree_hash()
+            if tree_hash == self.startup_cache_data.get("command_tree_hash"):
+                logger.bind(hash=tree_hash[:12]).info("Slash Commands Unchanged")
+                return
+            await self.slash_commands.sync()
+            self.startup_cache_data["command_tree_hash"] = tree_hash
+            await asyncio.to_thread(self.startup_cache.save, dict(self.startup_cache_data))
+            logger.bind(hash=tree_hash[:12]).info("Slash Commands Synced")
 
 
     async def register_slash_commands(self):
         toggle_user_ban_command = discord.app_commands.Command(name="toggle_user_ban",
                                                                description="Toggles whether a user is banned or not",
                                                                callback=self.toggle_user_ban)
+        flush_rag_cache_command = discord.app_commands.Command(name="flush_rag_cache",
+                                                               description="Drops all cached RAG results",
+                                                               callback=self.flush_rag_cache)
+        flush_rag_cache_command.default_permissions = discord.Permissions(administrator=True)
+        cancel_command = discord.app_commands.Command(name="cancel",
+                                                      description="Cancels all of your queued and running requests",
+                                                      callback=self.cancel_requests)
         clear_chat_command = discord.app_commands.Command(name="clear_chat_history",
                                                           description="Clears the users chat history with the LLM",
                                                           callback=self.clear_chat_history)
@@ -176,6 +351,8 @@ class Metatron3(discord.Client):
                                                                callback=self.qwen_image_edit_gen)
         qwen_image_edit_command._params["lora_name"].choices = self.qwen_image_loras_choices
         self.slash_commands.add_command(toggle_user_ban_command)
+        self.slash_commands.add_command(flush_rag_cache_command)
+        self.slash_commands.add_command(cancel_command)
         self.slash_commands.add_command(clear_chat_command)
         self.slash_commands.add_command(mtg_command)
         self.slash_commands.add_command(mtg_three_pack_command)
@@ -188,31 +365,37 @@ class Metatron3(discord.Client):
         self.slash_commands.add_command(qwen_image_command)
         self.slash_commands.add_command(qwen_image_edit_command)
 
-    @staticmethod
-    async def toggle_user_ban(interaction: discord.Interaction, user_id: str):
-        """Toggles the 'banned' setting for the user in their JSON file.
-        If the key exists, it flips its boolean value.
-        If it does not exist, it sets 'banned' to True."""
-        file_path = f"configs/users/{user_id}.json"
+    async def toggle_user_ban(self, interaction: discord.Interaction, user_id: str):
+        """Toggles whether the user is banned in the user store"""
         try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as file:
-                    try:
-                        user_data = json.load(file)
-                    except json.JSONDecodeError:  # Handle empty or corrupted files
-                        user_data = {}
-            else:
-                user_data = {}
-            # Toggle or set the 'banned' key
-            user_data["banned"] = not user_data.get("banned", False)
-            # Write back to the file
-            with open(file_path, 'w') as file:
-                json.dump(user_data, file, indent=4)
-            await interaction.response.send_message(f'Ban toggled for user:{user_id} Banned:{user_data["banned"]}',
+            banned = await self.user_store.toggle_ban(user_id)
+            await interaction.response.send_message(f'Ban toggled for user:{user_id} Banned:{banned}',
                                                     ephemeral=True, delete_after=5)
         except Exception as e:
             logger.info(f"Ban exception: {e}")
 
+    async def flush_rag_cache(self, interaction: discord.Interaction):
+        """Drops the cached RAG results so updated RAG documents are used straight away"""
+        try:
+            rag_cache_stats = self.avernus_client.rag_cache.stats()
+            flushed = self.avernus_client.rag_cache.clear()
+            await interaction.response.send_message(f'Flushed {flushed} cached RAG results. '
+                                                    f'Hits:{rag_cache_stats["hits"]} Misses:{rag_cache_stats["misses"]}',
+                                                    ephemeral=True, delete_after=5)
+            logger.bind(user=interaction.user.name, flushed=flushed).info("RAG Cache Flushed")
+        except Exception as e:
+            logger.info(f"RAG cache flush exception: {e}")
+
+    async def cancel_requests(self, interaction: discord.Interaction):
+        """Cancels every queued and running request of the user"""
+        cancelled = 0
+        for queue_request in self.request_queue.user_requests(interaction.user.id):
+            if await self.request_queue.cancel(queue_request):
+                cancelled += 1
+        await interaction.response.send_message(f"Cancelled {cancelled} requests.", ephemeral=True, delete_after=5)
+        cancel_logger = logger.bind(user=interaction.user.name, cancelled=cancelled)
+        cancel_logger.info("Requests Cancelled")
+
     async def clear_chat_history(self, interaction: discord.Interaction):
         """Clears a users saved llm chat history"""
 
@@ -222,9 +405,11 @@ class Metatron3(discord.Client):
             clear_chat_queue_logger = logger.bind(user=interaction.user.name)
             clear_chat_queue_logger.info(f'Chat History Cleared')
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(clear_chat_request)
+            eta = await self.get_queue_eta(clear_chat_request)
             await interaction.response.send_message(
-                f"Clearing chat history: {size} requests in queue ahead of you.", ephemeral=True
+                f"Clearing chat history: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, clear_chat_request)
             )
             await self.request_queue.put(clear_chat_request)
         else:
@@ -242,9 +427,11 @@ class Metatron3(discord.Client):
             card_queue_logger = logger.bind(user=interaction.user.name, prompt=prompt)
             card_queue_logger.info(f'Card Queued')
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(mtg_card_request)
+            eta = await self.get_queue_eta(mtg_card_request)
             await interaction.response.send_message(
-                f"Card Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Card Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, mtg_card_request)
             )
             await self.request_queue.put(mtg_card_request)
         else:
@@ -261,9 +448,11 @@ class Metatron3(discord.Client):
             card_queue_logger = logger.bind(user=interaction.user.name, prompt=prompt)
             card_queue_logger.info(f'Flux Card Queued')
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(mtg_card_request)
+            eta = await self.get_queue_eta(mtg_card_request)
             await interaction.response.send_message(
-                f"Flux Card Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Flux Card Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, mtg_card_request)
             )
             await self.request_queue.put(mtg_card_request)
         else:
@@ -280,9 +469,11 @@ class Metatron3(discord.Client):
             card_queue_logger = logger.bind(user=interaction.user.name, prompt=prompt)
             card_queue_logger.info(f'Card Pack Queued')
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(mtg_card_request)
+            eta = await self.get_queue_eta(mtg_card_request)
             await interaction.response.send_message(
-                f"Pack Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Pack Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, mtg_card_request)
             )
             await self.request_queue.put(mtg_card_request)
         else:
@@ -299,9 +490,11 @@ class Metatron3(discord.Client):
             card_queue_logger = logger.bind(user=interaction.user.name, prompt=prompt)
             card_queue_logger.info(f'Flux Card Pack Queued')
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(mtg_card_request)
+            eta = await self.get_queue_eta(mtg_card_request)
             await interaction.response.send_message(
-                f"Pack Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Pack Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, mtg_card_request)
             )
             await self.request_queue.put(mtg_card_request)
         else:
@@ -326,6 +519,7 @@ class Metatron3(discord.Client):
                        control_image: Optional[discord.Attachment],
                        control_strength: Optional[float],
                        guidance_scale: Optional[float],
+                       seed: Optional[int],
                        batch_size: Optional[int] = 4,):
         """This is the slash command to generate SDXL images
 
@@ -347,6 +541,7 @@ class Metatron3(discord.Client):
             control_image: An image to supply to the controlnet processor
             control_strength: Default=0.5: A number between 0-1 representing the balance between the controlnet and the generation.
             guidance_scale: Default=5.0: A floating point number altering the strength of classifier free guidance.
+            seed: Default=None: A fixed seed for repeatable results
             batch_size: Default=4: How many images to gen at once. More images take longer and can potentially crash
 
         Returns:
@@ -382,7 +577,8 @@ class Metatron3(discord.Client):
                                            control_processor=control_processor,
                                            control_image=control_image,
                                            control_strength=control_strength,
-                                           guidance_scale=guidance_scale)
+                                           guidance_scale=guidance_scale,
+                                           seed=seed)
         else:
             sdxl_request = SDXLGen(self,
                                    prompt,
@@ -401,15 +597,18 @@ class Metatron3(discord.Client):
                                    control_processor=control_processor,
                                    control_image=control_image,
                                    control_strength=control_strength,
-                                   guidance_scale=guidance_scale)
+                                   guidance_scale=guidance_scale,
+                                   seed=seed)
 
         if await self.is_room_in_queue(interaction.user.id):
             sdxl_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             sdxl_queuelogger.info("SDXL Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(sdxl_request)
+            eta = await self.get_queue_eta(sdxl_request)
             await interaction.response.send_message(
-                f"SDXL Image Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"SDXL Image Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, sdxl_request)
             )
             await self.request_queue.put(sdxl_request)
         else:
@@ -429,6 +628,7 @@ class Metatron3(discord.Client):
                        ipadapter_image: Optional[discord.Attachment],
                        ipadapter_strength: Optional[float],
                        guidance_scale: Optional[float],
+                       seed: Optional[int],
                        batch_size: Optional[int] = 4):
         """This is the slash command to generate Flux images
 
@@ -445,6 +645,7 @@ class Metatron3(discord.Client):
             ipadapter_image: An image to extract a style or contents from.
             ipadapter_strength: Default=0.6: A number between 0-1 that represents the strength of the extracted style
             guidance_scale: Default=3.5: A floating point number altering the strength of classifier free guidance.
+            seed: Default=None: A fixed seed for repeatable results
             batch_size: Default=4: How many images to gen at once. More images take longer and can potentially crash
 
         Returns:
@@ -472,7 +673,8 @@ class Metatron3(discord.Client):
                                            strength=i2i_strength,
                                            ipadapter_image=ipadapter_image,
                                            ipadapter_strength=ipadapter_strength,
-                                           guidance_scale=guidance_scale)
+                                           guidance_scale=guidance_scale,
+                                           seed=seed)
         else:
             flux_request = FluxGen(self,
                                    prompt,
@@ -486,15 +688,18 @@ class Metatron3(discord.Client):
                                    strength=i2i_strength,
                                    ipadapter_image=ipadapter_image,
                                    ipadapter_strength=ipadapter_strength,
-                                   guidance_scale=guidance_scale)
+                                   guidance_scale=guidance_scale,
+                                   seed=seed)
 
         if await self.is_room_in_queue(interaction.user.id):
             flux_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             flux_queuelogger.info("Flux Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(flux_request)
+            eta = await self.get_queue_eta(flux_request)
             await interaction.response.send_message(
-                f"Flux Image Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Flux Image Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, flux_request)
             )
             await self.request_queue.put(flux_request)
 
@@ -561,9 +766,11 @@ class Metatron3(discord.Client):
             flux_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             flux_queuelogger.info("Kontext Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(flux_request)
+            eta = await self.get_queue_eta(flux_request)
             await interaction.response.send_message(
-                f"Kontext Image Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Kontext Image Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, flux_request)
             )
             await self.request_queue.put(flux_request)
 
@@ -601,9 +808,11 @@ class Metatron3(discord.Client):
             sdxl_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             sdxl_queuelogger.info("ACE Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(ace_request)
+            eta = await self.get_queue_eta(ace_request)
             await interaction.response.send_message(
-                f"ACE mp3 Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"ACE mp3 Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, ace_request)
             )
             await self.request_queue.put(ace_request)
         else:
@@ -622,6 +831,7 @@ class Metatron3(discord.Client):
                             i2i_image: Optional[discord.Attachment],
                             i2i_strength: Optional[float],
                             true_cfg_scale: Optional[float],
+                            seed: Optional[int],
                             batch_size: Optional[int] = 4):
         """This is the slash command to generate Qwen Image images
 
@@ -637,6 +847,7 @@ class Metatron3(discord.Client):
             i2i_image: An image to use as a base for generation
             i2i_strength: Default=0.7: A number between 0-1 that represents the percent of pixels to replace in the i2i_image
             true_cfg_scale: Default=4.0: A floating point number altering the strength of classifier free guidance.
+            seed: Default=None: A fixed seed for repeatable results
             batch_size: Default=4: How many images to gen at once. More images take longer and can potentially crash
 
         Returns:
@@ -659,7 +870,8 @@ class Metatron3(discord.Client):
                                                       i2i_image=i2i_image,
                                                       strength=i2i_strength,
                                                       negative_prompt=negative_prompt,
-                                                      true_cfg_scale=true_cfg_scale)
+                                                      true_cfg_scale=true_cfg_scale,
+                                                      seed=seed)
         else:
             qwen_image_request = QwenImageGen(self,
                                               prompt,
@@ -672,15 +884,18 @@ class Metatron3(discord.Client):
                                               i2i_image=i2i_image,
                                               strength=i2i_strength,
                                               negative_prompt=negative_prompt,
-                                              true_cfg_scale=true_cfg_scale)
+                                              true_cfg_scale=true_cfg_scale,
+                                              seed=seed)
 
         if await self.is_room_in_queue(interaction.user.id):
             qwen_image_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             qwen_image_queuelogger.info("Qwen Image Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(qwen_image_request)
+            eta = await self.get_queue_eta(qwen_image_request)
             await interaction.response.send_message(
-                f"Qwen Image Image Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Qwen Image Image Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, qwen_image_request)
             )
             await self.request_queue.put(qwen_image_request)
 
@@ -740,9 +955,11 @@ class Metatron3(discord.Client):
             qwen_image_edit_queuelogger = logger.bind(user=interaction.user.name, prompt=prompt)
             qwen_image_edit_queuelogger.info("Qwen Image Edit Queued")
             self.request_queue_concurrency_list[interaction.user.id] += 1
-            size = await self.get_queue_depth()
+            size = await self.get_queue_position(qwen_image_edit_request)
+            eta = await self.get_queue_eta(qwen_image_edit_request)
             await interaction.response.send_message(
-                f"Qwen Image Edit Image Being Created: {size} requests in queue ahead of you", ephemeral=True
+                f"Qwen Image Edit Image Being Created: {size} requests in queue ahead of you. ETA:`{eta}`", ephemeral=True,
+                view=QueuedButtons(self, qwen_image_edit_request)
             )
             await self.request_queue.put(qwen_image_edit_request)
 
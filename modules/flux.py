@@ -1,14 +1,16 @@
-import base64
 import io
 import re
 import time
 import discord
 from loguru import logger
-from PIL import Image
-from modules.settings_loader import SettingsLoader
+from modules.queue_buttons import QueuedButtons
+from modules.settings_loader import get_settings
 
 class FluxGen:
     """This is the queue object for flux generations"""
+    request_class = "flux"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -22,8 +24,9 @@ class FluxGen:
                  strength=None,
                  ipadapter_image=None,
                  ipadapter_strength=None,
-                 guidance_scale=None):
-        self.settings = SettingsLoader("configs")
+                 guidance_scale=None,
+                 seed=None):
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -42,6 +45,14 @@ class FluxGen:
         self.ipadapter_image_base64 = None
         self.ipadapter_strength = ipadapter_strength
         self.guidance_scale = guidance_scale
+        self.seed = seed
+        self.affinity_key = ("flux", self.lora_name)
+        if self.i2i_image is None and self.ipadapter_image is None:
+            # seeded requests only share a key with identical ones, which the image batcher deduplicates
+            self.batch_key = (type(self).__name__, self.prompt, self.lora_name, self.width, self.height,
+                              self.guidance_scale, self.seed, self.batch_size if self.seed is not None else None)
+        else:
+            self.batch_key = None
 
 
     async def run(self):
@@ -72,9 +83,11 @@ class FluxGen:
                 kwargs["ip_adapter_strength"] = self.ipadapter_strength
             if self.guidance_scale:
                 kwargs["guidance_scale"] = self.guidance_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
 
-            base64_images = await self.avernus_client.flux_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("flux_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -99,6 +112,7 @@ class FluxGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             sdxl_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             sdxl_logger.info("FLUX Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Flux Error: {e}")
@@ -114,33 +128,26 @@ class FluxGen:
 
         return discord_files
 
-    @staticmethod
-    async def base64_to_pil_images(base64_images):
+    async def base64_to_pil_images(self, base64_images):
         """Converts a list of base64 images into a list of file-like objects."""
-        image_files = []
-        for base64_image in base64_images:
-            img_data = base64.b64decode(base64_image)  # Decode base64 string
-            img_file = io.BytesIO(img_data)  # Convert to file-like object
-            image_files.append(img_file)
+        return await self.discord_client.image_codec.decode_base64_images(base64_images)
 
-        return image_files
-
-    @staticmethod
-    async def image_to_base64(image, width, height):
-        attachment_buffer = io.BytesIO()
-        await image.save(attachment_buffer)
-        image = Image.open(attachment_buffer)
-        image = image.convert("RGB")
-        image = image.resize((width, height))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    async def image_to_base64(self, image, width, height):
+        return await self.discord_client.image_codec.encode_attachment(image, width, height,
+                                                                       binary=self.avernus_client.binary_uploads)
 
 class FluxGenEnhanced(FluxGen):
+    """Enhances the prompt with the chat LLM before generating. Enhanced prompts are cached, so rerolls reuse the
+    previous enhancement unless refresh_enhancement is set."""
+    def __init__(self, *args, refresh_enhancement=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_enhancement = refresh_enhancement
+
     async def run(self):
         start_time = time.time()
         try:
-            enhanced_prompt = await self.avernus_client.llm_chat(f"Turn the following prompt into a three sentence visual description of it. Here is the prompt: {self.prompt}")
+            enhanced_prompt = await self.discord_client.prompt_enhancer.enhance(
+                self.prompt, self.settings["avernus"]["llm_model"], refresh=self.refresh_enhancement)
             kwargs = {"prompt": self.prompt}
             if self.height:
                 kwargs["height"] = self.height
@@ -166,8 +173,10 @@ class FluxGenEnhanced(FluxGen):
                 kwargs["ip_adapter_strength"] = self.ipadapter_strength
             if self.guidance_scale:
                 kwargs["guidance_scale"] = self.guidance_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
-            base64_images = await self.avernus_client.flux_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("flux_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -189,6 +198,7 @@ class FluxGenEnhanced(FluxGen):
                                          ipadapter_strength=self.ipadapter_strength,
                                          guidance_scale=self.guidance_scale))
             sdxl_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             sdxl_logger.info("FLUX Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Flux Error: {e}")
@@ -198,6 +208,9 @@ class FluxGenEnhanced(FluxGen):
 
 class FluxKontextGen:
     """This is the queue object for flux generations"""
+    request_class = "flux"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -212,7 +225,7 @@ class FluxKontextGen:
                  ipadapter_image=None,
                  ipadapter_strength=None,
                  guidance_scale=None):
-        self.settings = SettingsLoader("configs")
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -231,6 +244,7 @@ class FluxKontextGen:
         self.ipadapter_image_base64 = None
         self.ipadapter_strength = ipadapter_strength
         self.guidance_scale = guidance_scale
+        self.affinity_key = ("flux_kontext", self.lora_name)
 
     async def run(self):
         start_time = time.time()
@@ -282,6 +296,7 @@ class FluxKontextGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             flux_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             flux_logger.info("FLUX Kontext Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Flux Error: {e}")
@@ -297,27 +312,12 @@ class FluxKontextGen:
 
         return discord_files
 
-    @staticmethod
-    async def base64_to_pil_images(base64_images):
+    async def base64_to_pil_images(self, base64_images):
         """Converts a list of base64 images into a list of file-like objects."""
-        image_files = []
-        for base64_image in base64_images:
-            img_data = base64.b64decode(base64_image)  # Decode base64 string
-            img_file = io.BytesIO(img_data)  # Convert to file-like object
-            image_files.append(img_file)
-
-        return image_files
+        return await self.discord_client.image_codec.decode_base64_images(base64_images)
 
-    @staticmethod
-    async def image_to_base64(image):
-        attachment_buffer = io.BytesIO()
-        await image.save(attachment_buffer)
-        image = Image.open(attachment_buffer)
-        image = image.convert("RGB")
-        #image = image.resize((width, height))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    async def image_to_base64(self, image):
+        return await self.discord_client.image_codec.encode_attachment(image, binary=self.avernus_client.binary_uploads)
 
 class FluxButtons(discord.ui.View):
     """Class for the ui buttons on /flux_gen"""
@@ -369,9 +369,12 @@ class FluxButtons(discord.ui.View):
                                    ipadapter_strength=self.ipadapter_strength,
                                    guidance_scale=self.guidance_scale,
                                    )
+            size = await self.discord_client.get_queue_position(flux_request)
+            eta = await self.discord_client.get_queue_eta(flux_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, flux_request)
             )
             flux_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             flux_queuelogger.info("Flux Queued")
@@ -410,7 +413,15 @@ class FluxEnhancedButtons(FluxButtons):
     """Class for the prompt enhanced ui buttons on /flux_gen"""
     @discord.ui.button(label='Reroll', emoji="🎲", style=discord.ButtonStyle.grey)
     async def reroll(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Rerolls last flux enhanced gen"""
+        """Rerolls last flux enhanced gen, reusing the enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=False)
+
+    @discord.ui.button(label='New Enhancement', emoji="✨", style=discord.ButtonStyle.grey)
+    async def new_enhancement(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Rerolls last flux enhanced gen with a newly enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=True)
+
+    async def queue_enhanced(self, interaction: discord.Interaction, refresh_enhancement):
         if await self.discord_client.is_room_in_queue(interaction.user.id):
             flux_request = FluxGenEnhanced(self.discord_client,
                                            self.prompt,
@@ -425,10 +436,14 @@ class FluxEnhancedButtons(FluxButtons):
                                            ipadapter_image=self.ipadapter_image,
                                            ipadapter_strength=self.ipadapter_strength,
                                            guidance_scale=self.guidance_scale,
+                                           refresh_enhancement=refresh_enhancement,
                                            )
+            size = await self.discord_client.get_queue_position(flux_request)
+            eta = await self.discord_client.get_queue_eta(flux_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, flux_request)
             )
             flux_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             flux_queuelogger.info("Flux Queued")
@@ -458,9 +473,12 @@ class FluxKontextButtons(FluxButtons):
                                           ipadapter_image=self.ipadapter_image,
                                           ipadapter_strength=self.ipadapter_strength,
                                           guidance_scale=self.guidance_scale)
+            size = await self.discord_client.get_queue_position(flux_request)
+            eta = await self.discord_client.get_queue_eta(flux_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, flux_request)
             )
             flux_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             flux_queuelogger.info("Flux Queued")
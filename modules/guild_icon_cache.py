@@ -0,0 +1,97 @@
+import asyncio
+import io
+import os
+from loguru import logger
+from PIL import Image, ImageDraw
+
+
+class GuildIconCache:
+    """Fetches guild icons through discord and caches them as the circled 42x42 PNG used as the MTG card set symbol.
+    Icons are kept in memory and on disk keyed by guild id and icon hash, so they are only fetched again when a guild
+    changes its icon. Guilds without an icon, or whose icon cant be fetched, get the default set icon."""
+    def __init__(self, cache_dir="assets/mtg_card_gen/guild_icons", icon_size=42,
+                 default_icon="assets/mtg_card_gen/icons/set_icon.png"):
+        self.cache_dir: str = cache_dir
+        self.icon_size: int = icon_size
+        self.default_icon: str = default_icon
+        self.icons: dict = {}
+        self.fetches: dict = {}
+        self.default_icon_bytes = None
+
+    async def get_icon(self, guild):
+        """Returns the set icon for a guild as PNG bytes"""
+        icon = guild.icon
+        if icon is None:
+            return await self.get_default_icon()
+        key = (guild.id, icon.key)
+        cached_icon = self.icons.get(guild.id)
+        if cached_icon is not None and cached_icon[0] == key:
+            return cached_icon[1]
+        fetch = self.fetches.get(key)
+        if fetch is None:
+            fetch = asyncio.create_task(self.fetch_icon(guild.id, icon))
+            self.fetches[key] = fetch
+            fetch.add_done_callback(lambda _: self.fetches.pop(key, None))
+        return await asyncio.shield(fetch)
+
+    async def fetch_icon(self, guild_id, icon):
+        """Loads a guild icon from the disk cache, or downloads and circles it and writes it to the disk cache"""
+        cache_path = os.path.join(self.cache_dir, f"{guild_id}_{icon.key}.png")
+        try:
+            if os.path.exists(cache_path):
+                icon_bytes = await asyncio.to_thread(self.read_file, cache_path)
+            else:
+                icon_bytes = await icon.read()
+                icon_bytes = await asyncio.to_thread(self.make_set_icon, icon_bytes, self.icon_size)
+                await asyncio.to_thread(self.write_file, cache_path, icon_bytes)
+        except Exception as e:
+            icon_logger = logger.bind(guild=guild_id, icon=icon.key)
+            icon_logger.warning(f"Guild Icon Fetch Failed: {e}")
+            return await self.get_default_icon()
+        self.icons[guild_id] = ((guild_id, icon.key), icon_bytes)
+        return icon_bytes
+
+    async def get_default_icon(self):
+        if self.default_icon_bytes is None:
+            self.default_icon_bytes = await asyncio.to_thread(self.read_file, self.default_icon)
+        return self.default_icon_bytes
+
+    @staticmethod
+    def read_file(path):
+        with open(path, "rb") as icon_file:
+            return icon_file.read()
+
+    @staticmethod
+    def write_file(path, icon_bytes):
+        """Writes to a temporary file first so a partly written icon is never read back"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as icon_file:
+            icon_file.write(icon_bytes)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def make_set_icon(cls, icon_bytes, icon_size):
+        """Circles and resizes a guild icon, returning it as PNG bytes"""
+        with Image.open(io.BytesIO(icon_bytes)) as server_icon:
+            icon_image = cls.make_circle(server_icon).resize((icon_size, icon_size))
+        with io.BytesIO() as icon_buffer:
+            icon_image.save(icon_buffer, format="PNG")
+            return icon_buffer.getvalue()
+
+    @staticmethod
+    def make_circle(image: Image.Image) -> Image.Image:
+        size = image.size[0]  # Since it's square, width and height are the same
+
+        # Create a blank RGBA image with transparency
+        circle_image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+
+        # Create a circular mask
+        mask = Image.new("L", (size, size), 0)
+        draw = ImageDraw.Draw(mask)
+        draw.ellipse((0, 0, size, size), fill=255)
+
+        # Apply the mask to the image
+        circle_image.paste(image, (0, 0), mask)
+
+        return circle_image
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from loguru import logger
+
+
+class ImageBatcher:
+    """Merges image requests with identical parameters that arrive within a short window into a single avernus call
+    with a larger batch_size, then splits the returned images back out to each caller. Requests with a seed or an
+    input image are sent on their own since merging them would change their results.
+
+    Requests with a seed are deterministic, so identical ones in flight at the same time are deduplicated instead: the
+    first is sent to avernus and the rest wait for its images. The shared call is only cancelled once every caller
+    waiting on it has been cancelled. The images of a finished seeded call are kept for result_ttl seconds, so an
+    identical request that starts while the first is still uploading its images reuses them too.
+
+    Merged calls are cancelled the same way. A caller cancelled before the window closes is dropped from the batch,
+    one cancelled after the call is sent leaves its share of the images unused, and the call itself is cancelled once
+    every caller in the batch has been cancelled."""
+    def __init__(self, avernus_client, window=0.05, max_batch_size=10, result_ttl=60.0, max_results=8):
+        self.avernus_client = avernus_client
+        self.window: float = window
+        self.max_batch_size: int = max_batch_size
+        self.pending: dict = {}
+        self.merged_calls: int = 0
+        self.in_flight: dict = {}
+        self.deduplicated_calls: int = 0
+        self.result_ttl: float = result_ttl
+        self.max_results: int = max_results
+        self.results: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def can_merge(kwargs):
+        """Returns whether a request is deterministic enough to be merged with others"""
+        if kwargs.get("seed") is not None:
+            return False
+        for image_key in ("image", "mask_image", "ip_adapter_image", "controlnet_image"):
+            if kwargs.get(image_key) is not None:
+                return False
+        return True
+
+    @staticmethod
+    def batch_key(method_name, kwargs):
+        """Builds the key requests must share to be merged, which is every parameter except batch_size"""
+        params = {key: value for key, value in kwargs.items() if key != "batch_size"}
+        return method_name, json.dumps(params, sort_keys=True, default=str)
+
+    @staticmethod
+    def request_hash(method_name, kwargs):
+        """Returns a canonical hash of an avernus call. Input images sent as bytes are hashed by their content."""
+        def encode(value):
+            if isinstance(value, bytes):
+                return {"sha256": hashlib.sha256(value).hexdigest()}
+            return str(value)
+        payload = json.dumps([method_name, kwargs], sort_keys=True, default=encode)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def deduplicate(self, method_name, method, kwargs):
+        """Sends a deterministic call unless an identical one is already in flight, in which case its images are
+        shared"""
+        key = self.request_hash(method_name, kwargs)
+        images = self.recent_result(key)
+        if images is not None:
+            self.deduplicated_calls += 1
+            dedup_logger = logger.bind(method=method_name, deduplicated=self.deduplicated_calls)
+            dedup_logger.info("Image Request Deduplicated")
+            return images
+        entry = self.in_flight.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(method(**kwargs)), "waiters": 0}
+            self.in_flight[key] = entry
+            entry["task"].add_done_callback(lambda task: self.call_done(key, task))
+        else:
+            self.deduplicated_calls += 1
+            dedup_logger = logger.bind(method=method_name, deduplicated=self.deduplicated_calls)
+            dedup_logger.info("Image Request Deduplicated")
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        except asyncio.CancelledError:
+            if not entry["task"].done() and entry["waiters"] == 1:
+                entry["task"].cancel()
+            raise
+        finally:
+            entry["waiters"] -= 1
+
+    def call_done(self, key, task):
+        """Removes a finished seeded call from the in flight calls and keeps its images if it succeeded"""
+        self.in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None or self.max_results <= 0:
+            return
+        self.results[key] = (time.monotonic() + self.result_ttl, task.result())
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+
+    def recent_result(self, key):
+        """Returns the images of a recently finished seeded call, or None if there are none or they expired"""
+        now = time.monotonic()
+        for expired_key in [result_key for result_key, (expires_at, _) in self.results.items() if expires_at <= now]:
+            del self.results[expired_key]
+        result = self.results.get(key)
+        return result[1] if result is not None else None
+
+    async def generate(self, method_name, **kwargs):
+        """Calls the named avernus image method, merging the call with other compatible pending calls"""
+        method = getattr(self.avernus_client, method_name)
+        if kwargs.get("seed") is not None:
+            return await self.deduplicate(method_name, method, kwargs)
+        if not self.can_merge(kwargs):
+            return await method(**kwargs)
+        batch_size = kwargs.get("batch_size") or 1
+        key = self.batch_key(method_name, kwargs)
+        group = self.pending.get(key)
+        if group is None or group["batch_size"] + batch_size > self.max_batch_size:
+            group = {"batch_size": 0, "requests": [], "waiters": 0, "sent": False}
+            self.pending[key] = group
+            group["task"] = asyncio.create_task(self.flush(key, group, method, kwargs))
+        future = asyncio.get_running_loop().create_future()
+        share = (batch_size, future)
+        group["batch_size"] += batch_size
+        group["requests"].append(share)
+        group["waiters"] += 1
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if not group["sent"]:
+                group["requests"].remove(share)
+                group["batch_size"] -= batch_size
+            if group["waiters"] == 1 and not group["task"].done():
+                if self.pending.get(key) is group:
+                    del self.pending[key]
+                group["task"].cancel()
+            raise
+        finally:
+            group["waiters"] -= 1
+
+    async def flush(self, key, group, method, kwargs):
+        """Waits for the window to close then sends the merged request and fans the images back out"""
+        await asyncio.sleep(self.window)
+        if self.pending.get(key) is group:
+            del self.pending[key]
+        group["sent"] = True
+        requests = group["requests"]
+        try:
+            images = await method(**{**kwargs, "batch_size": group["batch_size"]})
+        except Exception as e:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(requests) > 1:
+            self.merged_calls += 1
+            batch_logger = logger.bind(requests=len(requests), batch_size=group["batch_size"])
+            batch_logger.info("Image Requests Merged")
+        offset = 0
+        for request_batch_size, future in requests:
+            if isinstance(images, list):
+                result = images[offset:offset + request_batch_size]
+                offset += request_batch_size
+            else:
+                result = images
+            if not future.done():
+                future.set_result(result)
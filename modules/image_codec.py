@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from PIL import Image
+
+
+def decode_base64_images(base64_images):
+    """Converts a list of base64 images into a list of file-like objects. Images avernus sent as raw bytes are
+    wrapped as they are."""
+    image_files = []
+    for base64_image in base64_images:
+        img_data = decode_base64_image_bytes(base64_image)  # Decode base64 string
+        img_file = io.BytesIO(img_data)  # Convert to file-like object
+        image_files.append(img_file)
+
+    return image_files
+
+
+def decode_base64_image_bytes(base64_image):
+    if isinstance(base64_image, bytes):
+        return base64_image
+    return base64.b64decode(base64_image)
+
+
+def encode_image(image_bytes, width=None, height=None, binary=False):
+    """Converts image bytes to RGB, optionally resizes it, and returns it as PNG bytes if binary is set or as a base64
+    PNG otherwise"""
+    image = Image.open(io.BytesIO(image_bytes))
+    image = image.convert("RGB")
+    if width is not None and height is not None:
+        image = image.resize((width, height))
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    if binary:
+        return buffered.getvalue()
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+class ImageCodec:
+    """Runs image decoding and encoding in a thread pool so large batches never block the discord event loop. PIL and
+    zlib release the GIL while they work. At most max_pending jobs are submitted at once, and the time spent in each
+    stage is tracked in stats, with slow jobs logged."""
+    def __init__(self, max_workers=4, max_pending=16, slow_threshold=0.25):
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="image_codec")
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(max_pending)
+        self.slow_threshold: float = slow_threshold
+        self.stats: dict = {}
+
+    async def run(self, stage, func, *args):
+        """Runs func in the codec pool and records how long it took under stage"""
+        async with self.semaphore:
+            start_time = time.perf_counter()
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            elapsed_time = time.perf_counter() - start_time
+        stage_stats = self.stats.setdefault(stage, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stage_stats["count"] += 1
+        stage_stats["total_seconds"] += elapsed_time
+        stage_stats["max_seconds"] = max(stage_stats["max_seconds"], elapsed_time)
+        if elapsed_time >= self.slow_threshold:
+            codec_logger = logger.bind(stage=stage, seconds=f"{elapsed_time:.3f}", count=stage_stats["count"])
+            codec_logger.warning("Slow Image Codec")
+        return result
+
+    async def decode_base64_images(self, base64_images):
+        """Converts a list of base64 images into a list of file-like objects."""
+        return await self.run("decode", decode_base64_images, base64_images)
+
+    async def decode_base64_image_bytes(self, base64_image):
+        """Decodes a single base64 image into bytes"""
+        return await self.run("decode", decode_base64_image_bytes, base64_image)
+
+    async def encode_attachment(self, attachment, width=None, height=None, binary=False):
+        """Reads a discord attachment and returns it as an RGB PNG, resized if a width and height are given. The PNG is
+        returned as raw bytes for binary uploads, or base64 otherwise."""
+        attachment_bytes = await attachment.read()
+        return await self.run("encode", encode_image, attachment_bytes, width, height, binary)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,132 @@
+import asyncio
+import inspect
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+SKIPPED_PARAMS = ("self", "discord_client", "channel", "user")
+
+
+class JournalAttachment:
+    """Stands in for the discord attachment of a replayed job, reading the file back from its discord CDN url"""
+    def __init__(self, discord_client, url, filename=None):
+        self.discord_client = discord_client
+        self.url: str = url
+        self.filename: str = filename
+
+    async def read(self):
+        return await self.discord_client.http.get_from_cdn(self.url)
+
+
+def get_job_params(request):
+    """Returns the constructor arguments of a queue object, read back from the attributes they are stored under.
+    Attachments are stored by url. Raises TypeError if an argument can not be stored as JSON."""
+    names = []
+    for cls in type(request).__mro__:
+        if "__init__" not in vars(cls):
+            continue
+        for name, parameter in inspect.signature(vars(cls)["__init__"]).parameters.items():
+            if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD) or name in SKIPPED_PARAMS:
+                continue
+            if name not in names:
+                names.append(name)
+    params = {}
+    for name in names:
+        value = getattr(request, name, None)
+        if hasattr(value, "url") and hasattr(value, "read"):
+            value = {"attachment_url": value.url, "filename": getattr(value, "filename", None)}
+        json.dumps(value)
+        params[name] = value
+    return params
+
+
+class JobJournal:
+    """SQLite journal of queued requests so a restart or crash does not drop them. Each queued request is written as a
+    compact job record (type, constructor arguments, channel id, user id and attachment urls) before it joins the
+    queue, and its record is deleted once it finishes, so the table only ever holds unfinished work. On startup the
+    remaining records are rebuilt into queue objects and queued again. Like the user store, queries run on a single
+    dedicated thread."""
+    def __init__(self, path="configs/cache/jobs.db"):
+        self.path: str = path
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job_journal")
+        self.connection = None
+
+    async def run(self, func, *args):
+        """Runs func on the journal thread"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def start(self):
+        await self.run(self.open)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_type TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    channel_id INTEGER,
+                    user_id INTEGER NOT NULL,
+                    user_name TEXT,
+                    created_at REAL NOT NULL
+                )""")
+
+    async def record(self, request):
+        """Writes a job record for a queue object and stores its id on it as job_id. Requests that already have a
+        record, such as replayed ones, are left alone."""
+        if getattr(request, "job_id", None) is not None or self.connection is None:
+            return
+        try:
+            params = json.dumps(get_job_params(request))
+        except TypeError as e:
+            logger.bind(job_type=type(request).__name__).warning(f"Job Not Journaled: {e}")
+            return
+        channel = getattr(request, "channel", None)
+        user = request.user
+        user_name = None if hasattr(user, "mention") else str(user)
+        request.job_id = await self.run(self._insert, type(request).__name__, params, getattr(channel, "id", None),
+                                        user.id, user_name)
+
+    def _insert(self, job_type, params, channel_id, user_id, user_name):
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (job_type, params, channel_id, user_id, user_name, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_type, params, channel_id, user_id, user_name, time.time()))
+            return cursor.lastrowid
+
+    async def complete(self, request):
+        """Deletes the job record of a finished queue object"""
+        job_id = getattr(request, "job_id", None)
+        if job_id is not None and self.connection is not None:
+            await self.discard(job_id)
+
+    async def discard(self, job_id):
+        await self.run(self._delete, job_id)
+
+    def _delete(self, job_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    async def pending_jobs(self):
+        """Returns the unfinished job records as dicts, oldest first"""
+        return await self.run(self._pending_jobs)
+
+    def _pending_jobs(self):
+        rows = self.connection.execute("""
+            SELECT id, job_type, params, channel_id, user_id, user_name, created_at FROM jobs ORDER BY id""").fetchall()
+        return [{"id": job_id, "job_type": job_type, "params": json.loads(params), "channel_id": channel_id,
+                 "user_id": user_id, "user_name": user_name, "created_at": created_at}
+                for job_id, job_type, params, channel_id, user_id, user_name, created_at in rows]
@@ -1,50 +1,57 @@
-import json
-import os
+import asyncio
 import time
 
 
 from loguru import logger
 
-from modules.settings_loader import SettingsLoader
+from modules.settings_loader import SettingsLoader, get_settings
 
 class LlmChat:
     """This is the queue object to generate chat."""
+    request_class = "llm"
+    succeeded = False
+
     def __init__(self, discord_client, prompt, channel, user):
-        self.settings: SettingsLoader = SettingsLoader("configs")
+        self.settings: SettingsLoader = get_settings("configs")
         self.prompt: str = prompt
         self.discord_client = discord_client
         self.channel = channel
         self.user = user
 
     async def run(self):
+        """Runs the chat in stages: RAG lookup and history loading at the same time, then generation, then saving the
+        turn. How long each stage took is logged with the chat."""
         start_time = time.time()
+        stage_times = {}
         try:
-            rag_results = await self.discord_client.avernus_client.rag_retrieve(self.prompt)
+            rag_results, history = await asyncio.gather(
+                self.timed(stage_times, "rag", self.discord_client.avernus_client.rag_retrieve(self.prompt)),
+                self.timed(stage_times, "history", self.get_history()))
             logger.info(rag_results)
-            combined_rag_result = ""
-            for result in rag_results:
-                combined_rag_result = combined_rag_result + result + " . "
-            if combined_rag_result != "":
-                self.rag_prompt = self.prompt + f". The following information was retrieved by RAG for supplemental information to the previous sentence. Only consider this information if its directly relevant to the chat: {combined_rag_result}"
-            else:
-                self.rag_prompt = self.prompt
-            history = await self.get_history()
-            if history is None:
-                response = await self.discord_client.avernus_client.llm_chat(self.rag_prompt,
-                                                                         self.settings["avernus"]["llm_model"])
-            else:
-                response = await self.discord_client.avernus_client.llm_chat(self.rag_prompt,
-                                                                             self.settings["avernus"]["llm_model"],
-                                                                             history)
-            await self.add_history("user", self.prompt)
-            await self.add_history("assistant", response)
+            self.rag_prompt = self.build_rag_prompt(rag_results)
+            generation_start = time.perf_counter()
+            header_message = None
+            reply = StreamedReply(self.channel, self.settings["discord"].get("llm_stream_edit_interval", 1.0))
+            async for new_text in self.discord_client.avernus_client.llm_chat_stream(
+                    self.rag_prompt, self.settings["avernus"]["llm_model"], history):
+                if header_message is None:
+                    stage_times["first_token"] = round(time.perf_counter() - generation_start, 3)
+                    first_token_time = time.time() - start_time
+                    header_message = await self.channel.send(
+                        f"{self.user.mention}  First token:`{first_token_time:.2f} seconds`")
+                await reply.add(new_text)
+            response = await reply.finish()
+            stage_times["generate"] = round(time.perf_counter() - generation_start, 3)
+            await self.timed(stage_times, "save", self.save_turn(response))
+            self.discord_client.chat_history.schedule_summary(self.user.id, self.settings["avernus"]["llm_model"])
             end_time = time.time()
             elapsed_time = end_time - start_time
-            await self.channel.send(f"{self.user.mention}  Time:`{elapsed_time:.2f} seconds`")
-            for i in range(0, len(response), 2000):
-                chunk = response[i:i + 2000]
-                await self.channel.send(content=chunk, mention_author=True)
-            generate_chat_logger = logger.bind(user=self.user, channel=self.channel)
+            if header_message is None:
+                await self.channel.send(f"{self.user.mention}  Time:`{elapsed_time:.2f} seconds`")
+            else:
+                await header_message.edit(content=f"{self.user.mention}  Time:`{elapsed_time:.2f} seconds`")
+            generate_chat_logger = logger.bind(user=self.user, channel=self.channel, stages=stage_times)
+            self.succeeded = True
             generate_chat_logger.info("Chat Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} LLM Error: {e}")
@@ -52,43 +59,98 @@ class LlmChat:
             llm_logger.error(f"LLM FAILURE: {e}")
 
 
-    async def add_history(self, role, content):
-        """Adds each message to a JSON file named after the user's ID."""
-        history_file = f"configs/users/{self.user.id}.json"
-        if os.path.exists(history_file):
-            with open(history_file, "r", encoding="utf-8") as file:
-                try:
-                    history = json.load(file)
-                except json.JSONDecodeError:
-                    history = {"history": []}
-        else:
-            history = {"history": []}
+    @staticmethod
+    async def timed(stage_times, stage, coroutine):
+        """Awaits a coroutine and records how many seconds it took under stage"""
+        stage_start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            stage_times[stage] = round(time.perf_counter() - stage_start, 3)
+
+    def build_rag_prompt(self, rag_results):
+        """Adds the RAG results to the prompt, keeping whole results until rag_max_characters is reached"""
+        if not isinstance(rag_results, list):
+            return self.prompt
+        max_characters = self.settings["discord"].get("rag_max_characters", 4000)
+        kept_results = []
+        used_characters = 0
+        for result in rag_results:
+            result = str(result)
+            remaining_characters = max_characters - used_characters
+            if remaining_characters <= 0:
+                break
+            if len(result) > remaining_characters:
+                if not kept_results:
+                    kept_results.append(result[:remaining_characters])
+                break
+            kept_results.append(result)
+            used_characters += len(result) + 3
+        combined_rag_result = " . ".join(kept_results)
+        if combined_rag_result == "":
+            return self.prompt
+        return self.prompt + f". The following information was retrieved by RAG for supplemental information to the previous sentence. Only consider this information if its directly relevant to the chat: {combined_rag_result} . "
+
+    async def save_turn(self, response):
+        await self.add_history("user", self.prompt)
+        await self.add_history("assistant", response)
 
-        if "history" not in history:
-            history["history"] = []
+    async def add_history(self, role, content):
+        """Adds a message to the user's chat history."""
+        await self.discord_client.chat_history.add_message(self.user.id, role, content)
 
-        history["history"].append({"role": role, "content": content})
+    async def get_history(self):
+        """Returns the user's history summary and the recent messages that fit in the history token budget"""
+        return await self.discord_client.chat_history.get_messages(self.user.id)
 
-        history["history"] = history["history"][-self.settings["discord"]["max_user_history_messages"]:]
-        with open(history_file, "w", encoding="utf-8") as file:
-            json.dump(history, file, ensure_ascii=False, indent=4)
 
-    async def get_history(self):
-        history_file = f"configs/users/{self.user.id}.json"
-        if os.path.exists(history_file):
-            with open(history_file, "r", encoding="utf-8") as file:
-                try:
-                    history = json.load(file)
-                except json.JSONDecodeError:
-                    history = None
-                finally:
-                    return history.get("history", [])
+class StreamedReply:
+    """Posts an llm response to a channel while it is being generated. The newest message is edited at most once every
+    edit_interval seconds to stay inside discords rate limits, and a new message is started whenever the current one
+    reaches discords 2000 character limit."""
+    def __init__(self, channel, edit_interval=1.0, max_length=2000):
+        self.channel = channel
+        self.edit_interval: float = edit_interval
+        self.max_length: int = max_length
+        self.text: str = ""
+        self.message = None
+        self.message_text: str = ""
+        self.shown_text: str = ""
+        self.last_edit: float = 0.0
+
+    async def add(self, new_text):
+        """Adds newly generated text, rolling over to new messages as needed and editing if the rate limit allows"""
+        self.text += new_text
+        self.message_text += new_text
+        while len(self.message_text) > self.max_length:
+            await self.show(self.message_text[:self.max_length])
+            self.message_text = self.message_text[self.max_length:]
+            self.message = None
+            self.shown_text = ""
+        if time.monotonic() - self.last_edit >= self.edit_interval:
+            await self.show(self.message_text)
+
+    async def finish(self):
+        """Shows any text that is still pending and returns the full response"""
+        await self.show(self.message_text)
+        return self.text
+
+    async def show(self, content):
+        if content == self.shown_text or not content.strip():
+            return
+        if self.message is None:
+            self.message = await self.channel.send(content=content, mention_author=True)
         else:
-            return None
+            await self.message.edit(content=content)
+        self.shown_text = content
+        self.last_edit = time.monotonic()
 
 
 class LlmChatClear:
     """This is the queue object to clear a users chat history."""
+    request_class = "llm"
+    succeeded = False
+
     def __init__(self, discord_client, channel, user):
         self.discord_client = discord_client
         self.channel = channel
@@ -99,22 +161,11 @@ class LlmChatClear:
             await self.forget_history()
             await self.channel.send(content=f"{self.user} chat history cleared.", delete_after=5)
             clear_chat_logger = logger.bind(user=self.user)
+            self.succeeded = True
             clear_chat_logger.info("LLM History Cleared")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} LLM Error: {e}")
             logger.info(f"LLM CLEAR HISTORY FAILURE: {e}")
 
     async def forget_history(self):
-        history_file = f"configs/users/{self.user.id}.json"
-        if os.path.exists(history_file):
-            with open(history_file, "r", encoding="utf-8") as file:
-                try:
-                    history = json.load(file)
-                except json.JSONDecodeError:
-                    history = {"history": []}
-        else:
-            history = {"history": []}
-
-        history["history"] = []
-        with open(history_file, "w", encoding="utf-8") as file:
-            json.dump(history, file, ensure_ascii=False, indent=4)
\ No newline at end of file
+        await self.discord_client.chat_history.clear(self.user.id)
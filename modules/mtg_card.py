@@ -1,4 +1,4 @@
-import base64
+import asyncio
 from datetime import datetime
 import io
 import json
@@ -8,23 +8,30 @@ import re
 import time
 import discord
 from loguru import logger
-import requests
-from PIL import Image, ImageFont, ImageDraw, ImageChops
-from modules.settings_loader import SettingsLoader
+from modules.mtg_card_assets import load_abilities
+from modules.settings_loader import get_settings
 
 with open('assets/mtg_card_gen/json/artist.json', 'r', encoding="utf-8") as file:
     artist_data = json.load(file)
 
 class MTGCardGen:
-    """This object builds a satire MTG card based on the users prompt"""
+    """This object builds a satire MTG card based on the users prompt. The text, art and random rolls are gathered
+    into a card spec which is rendered in the card renderers process pool."""
+    request_class = "mtg"
+    succeeded = False
+    affinity_key = ("sdxl", None, None)
+    card_count = 1
+
 
     def __init__(self, discord_client, prompt, channel, user):
-        self.settings = SettingsLoader("configs")
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.prompt = prompt
         self.channel = channel
         self.user = user
-        self.card = None
+        self.card_png = None
+        self.card_webp = None
+        self.card_art = None
         self.card_title = None
         self.card_flavor_text = None
         self.card_artist = None
@@ -34,32 +41,18 @@ class MTGCardGen:
         self.card_secondary_mana = None
         self.card_creature_type = None
         self.card_is_legendary = False
+        self.card_type_line = None
+        self.card_ability_text = None
+        self.card_power_toughness = None
+        self.card_land_mana_icon = None
 
     async def run(self):
-        """Builds a PIL image containing a card"""
+        """Builds and sends a card"""
         start_time = time.time()
         try:
-            self.card_primary_mana = random.choice(range(1, 5))
-            self.card_secondary_mana = random.choice(range(0, 5))
-            self.choose_card_type()
-            self.load_card_template()
-            card_build_methods = {
-                'creature': self.build_creature_card,
-                'land': self.build_land_card,
-                'instant': self.build_instant_card,
-                'sorcery': self.build_sorcery_card,
-                'artifact': self.build_artifact_card,
-                'enchant': self.build_enchant_card,
-            }
-
-            for card_category, build_method in card_build_methods.items():
-                if self.is_card_type(card_category):
-                    await build_method()
-                    break  # Only one type should match, so we stop after the first
-
-            with io.BytesIO() as file_object:
-                self.card.save(file_object, format="PNG")
-                file_object.seek(0)
+            await self.build_card()
+
+            with io.BytesIO(self.card_png) as file_object:
                 filename = f'lighty_mtg_{self.prompt[:20]}.png'
                 end_time = time.time()
                 elapsed_time = end_time - start_time
@@ -71,17 +64,45 @@ class MTGCardGen:
             sanitized_prompt = re.sub(r'[<>:"/\\|?*\x00-\x1F]', '', self.prompt)
             dir_path = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
             os.makedirs(os.path.dirname(dir_path), exist_ok=True)
-            self.card.save(dir_path, format="WEBP")
+            with open(dir_path, "wb") as card_file:
+                card_file.write(self.card_webp)
 
             message_link = f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}"
 
             lightycard_logger = logger.bind(user=f'{self.user}', prompt=self.prompt, link=message_link)
+            self.succeeded = True
             lightycard_logger.info("Card Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Flux Error: {e}")
             flux_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
             flux_logger.error(f"FLUX ERROR: {e}")
 
+    async def build_card(self):
+        """Rolls the card type and mana, gathers the card text and art, then renders the card into self.card_png and
+        self.card_webp"""
+        self.card_primary_mana = random.choice(range(1, 5))
+        self.card_secondary_mana = random.choice(range(0, 5))
+        self.choose_card_type()
+        card_build_methods = {
+            'creature': self.build_creature_card,
+            'land': self.build_land_card,
+            'instant': self.build_instant_card,
+            'sorcery': self.build_sorcery_card,
+            'artifact': self.build_artifact_card,
+            'enchant': self.build_enchant_card,
+        }
+
+        for card_category, build_method in card_build_methods.items():
+            if self.is_card_type(card_category):
+                await build_method()
+                break  # Only one type should match, so we stop after the first
+
+        card_spec = await self.build_card_spec()
+        rendered_card = await self.discord_client.card_renderer.render(card_spec)
+        self.card_png = rendered_card["png"]
+        self.card_webp = rendered_card["webp"]
+        return self.card_png
+
     def choose_card_type(self):
         """Returns a random card type and associated color"""
 
@@ -111,12 +132,6 @@ class MTGCardGen:
         self.card_type = random.choice(card_type_mapping[base_card_type])
         self.card_color = card_color_mapping.get(self.card_type, 'error')
 
-    def load_card_template(self):
-        """Loads the base card template"""
-        image_path = f"assets/mtg_card_gen/templates/{self.card_type}.png"
-        with Image.open(image_path) as card_image:
-            self.card = card_image.copy()
-
     def is_card_type(self, category):
         """Generalized function to check card type"""
         card_type_mapping = {
@@ -136,93 +151,127 @@ class MTGCardGen:
         self.card_creature_type = self.generate_abilities('type_creature')
         await self.generate_card_text('creature')
         await self.generate_card_image('creature')
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_creature_card_atk_def()
-        self.paste_mana()
-        self.paste_type(self.card_creature_type)
-        self.paste_ability("creature")
-        self.roll_signature()
+        self.card_power_toughness = self.roll_creature_atk_def()
+        self.card_type_line = self.card_creature_type
+        self.card_ability_text = self.generate_abilities("creature")
 
     async def build_land_card(self):
         """Builds a land card"""
         await self.generate_card_text('land')
         await self.generate_land_image()
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_land_abilities()
+        self.card_land_mana_icon = self.roll_land_mana_icon()
         if self.card_is_legendary is True:
-            self.paste_type("Legendary Land")
+            self.card_type_line = "Legendary Land"
         else:
-            self.paste_type("Land")
-        self.roll_signature()
+            self.card_type_line = "Land"
 
     async def build_instant_card(self):
         """Builds an instant card"""
         await self.generate_card_text('instant')
         await self.generate_card_image('spell')
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_mana()
-        self.paste_type("Instant")
-        self.paste_ability("instant")
-        self.roll_signature()
+        self.card_type_line = "Instant"
+        self.card_ability_text = self.generate_abilities("instant")
 
     async def build_sorcery_card(self):
         """Builds a sorcery card"""
         await self.generate_card_text('spell')
         await self.generate_card_image('spell')
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_mana()
-        self.paste_type("Sorcery")
-        self.paste_ability("sorcery")
-        self.roll_signature()
+        self.card_type_line = "Sorcery"
+        self.card_ability_text = self.generate_abilities("sorcery")
 
     async def build_artifact_card(self):
         """Builds an artifact card"""
         await self.generate_card_text('artifact')
         await self.generate_card_image('artifact')
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_mana()
-        self.paste_type("Artifact")
-        self.paste_ability("artifact")
-        self.roll_signature()
+        self.card_type_line = "Artifact"
+        self.card_ability_text = self.generate_abilities("artifact")
 
     async def build_enchant_card(self):
         """Builds an enchantment card"""
         await self.generate_card_text('enchant')
         await self.generate_card_image('spell')
-        self.roll_foil()
-        self.paste_title_text()
-        self.paste_artist_copyright()
-        self.paste_mana()
-        self.paste_type('Enchantment')
-        self.paste_ability('enchant')
-        self.roll_signature()
+        self.card_type_line = 'Enchantment'
+        self.card_ability_text = self.generate_abilities('enchant')
+
+    async def build_card_spec(self):
+        """Rolls the foil, signature and mana icons and returns everything the renderer needs as a picklable dict"""
+        is_foil = random.randint(1, 50) == 1
+        return {
+            "card_type": self.card_type,
+            "card_color": self.card_color,
+            "primary_mana": self.card_primary_mana,
+            "secondary_mana": self.card_secondary_mana,
+            "use_secondary_mana": random.randint(0, 2) == 1,
+            "gold_mana_colors": [random.choice(['red', 'black', 'white', 'green', 'blue'])
+                                 for _ in range(self.card_primary_mana)],
+            "title": self.card_title,
+            "flavor_text": self.card_flavor_text,
+            "artist": self.card_artist,
+            "art": self.card_art,
+            "type_line": self.card_type_line,
+            "ability_text": self.card_ability_text,
+            "power_toughness": self.card_power_toughness,
+            "land_mana_icon": self.card_land_mana_icon,
+            "user_name": f"{self.user}",
+            "guild_name": self.channel.guild.name,
+            "is_foil": is_foil,
+            "set_icon": None if is_foil else await self.discord_client.guild_icon_cache.get_icon(self.channel.guild),
+            "is_signed": random.randint(1, 100) == 1,
+        }
 
 
     @staticmethod
     def generate_abilities(ability_file):
         """Returns a random card ability from the specified json file."""
-        with open(f"assets/mtg_card_gen/json/{ability_file}.json", 'r') as instant_file:
-            data = json.load(instant_file)
-        return random.choice(data)
+        return random.choice(load_abilities(ability_file))
 
     async def generate_card_text(self, card_type):
-        """Generates and returns a card title and card flavor text"""
+        """Generates a card title and card flavor text with a single llm call that returns both as JSON. If the
+        response cant be parsed, falls back to asking for the title and flavor text separately and concurrently."""
+        card_text_prompt = (f"Create a new random Magic The Gathering {card_type} card title and flavor text based on "
+                            f"{self.prompt}. The title cannot be longer than 25 characters and the flavor text is one "
+                            f"sentence. You respond with ONLY a JSON object in the form "
+                            f'{{"title": "the title", "flavor_text": "the flavor text"}}')
+        response = await self.discord_client.avernus_client.llm_chat(card_text_prompt,
+                                                                     self.settings["avernus"]["mtg_llm_model"])
+        card_text = self.parse_card_text(response)
+        if card_text is not None:
+            self.card_title, self.card_flavor_text = card_text
+            return
+
+        card_text_logger = logger.bind(user=f'{self.user}', response=response)
+        card_text_logger.warning("Card Text Fallback")
         title_prompt = f"Create a new random Magic The Gathering {card_type} card title based on {self.prompt}. You respond with ONLY the title and it cannot be longer than 25 characters"
         flavor_prompt = f"Create a new random Magic The Gathering {card_type} card flavor text based on {self.prompt}. You respond with ONLY one sentence of flavor text."
-        self.card_title = await self.discord_client.avernus_client.llm_chat(title_prompt,
-                                                                            self.settings["avernus"]["mtg_llm_model"])
-        self.card_flavor_text = await self.discord_client.avernus_client.llm_chat(flavor_prompt,
-                                                                            self.settings["avernus"]["mtg_llm_model"])
+        self.card_title, self.card_flavor_text = await asyncio.gather(
+            self.discord_client.avernus_client.llm_chat(title_prompt, self.settings["avernus"]["mtg_llm_model"]),
+            self.discord_client.avernus_client.llm_chat(flavor_prompt, self.settings["avernus"]["mtg_llm_model"]))
+
+    @staticmethod
+    def parse_card_text(response):
+        """Parses a JSON title and flavor text llm response, returning (title, flavor_text) or None if it is not
+        usable. Tolerates code fences and text around the JSON object."""
+        if not isinstance(response, str):
+            return None
+        start = response.find("{")
+        end = response.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            card_text = json.loads(response[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(card_text, dict):
+            return None
+        title = card_text.get("title")
+        flavor_text = card_text.get("flavor_text", card_text.get("flavor"))
+        if not isinstance(title, str) or not isinstance(flavor_text, str):
+            return None
+        title = title.strip().strip('"')
+        flavor_text = flavor_text.strip().strip('"')
+        if not title or not flavor_text:
+            return None
+        return title, flavor_text
 
     async def generate_card_image(self, category):
         """Prepares the prompt and generates an image based on the card category."""
@@ -234,7 +283,7 @@ class MTGCardGen:
         }
         generation_prompt = category_prompts.get(category)
         try:
-            channel_settings = SettingsLoader("configs/channels")
+            channel_settings = get_settings("configs/channels")
             lora_name = channel_settings[f"{self.channel.id}"]["lora_name"]
             lora_prompt = channel_settings[f"{self.channel.id}"]["lora_prompt"]
         except Exception as e:
@@ -242,14 +291,12 @@ class MTGCardGen:
 
         if lora_name:
             generation_prompt = lora_prompt + generation_prompt
-            base64_image = await self.discord_client.avernus_client.sdxl_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               lora_name=lora_name)
+            base64_image = await self.discord_client.image_batcher.generate("sdxl_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            lora_name=lora_name)
         else:
-            base64_image = await self.discord_client.avernus_client.sdxl_image(generation_prompt, batch_size=1)
-        image = await self.base64_to_pil_images(base64_image[0])
-        resized_image = image.resize((568, 465))
-        self.card.paste(resized_image, (88, 102))
+            base64_image = await self.discord_client.image_batcher.generate("sdxl_image", prompt=generation_prompt, batch_size=1)
+        self.card_art = await self.discord_client.image_codec.decode_base64_image_bytes(base64_image[0])
 
 
     async def generate_land_image(self):
@@ -265,7 +312,7 @@ class MTGCardGen:
         }
         generation_prompt = land_color_mapping.get(self.card_type)
         try:
-            channel_settings = SettingsLoader("configs/channels")
+            channel_settings = get_settings("configs/channels")
             lora_name = channel_settings[f"{self.channel.id}"]["lora_name"]
             lora_prompt = channel_settings[f"{self.channel.id}"]["lora_prompt"]
         except Exception as e:
@@ -273,14 +320,12 @@ class MTGCardGen:
 
         if lora_name:
             generation_prompt = lora_prompt + generation_prompt
-            base64_image = await self.discord_client.avernus_client.sdxl_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               lora_name=lora_name)
+            base64_image = await self.discord_client.image_batcher.generate("sdxl_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            lora_name=lora_name)
         else:
-            base64_image = await self.discord_client.avernus_client.sdxl_image(generation_prompt, batch_size=1)
-        image = await self.base64_to_pil_images(base64_image[0])
-        resized_image = image.resize((568, 465))
-        self.card.paste(resized_image, (88, 102))
+            base64_image = await self.discord_client.image_batcher.generate("sdxl_image", prompt=generation_prompt, batch_size=1)
+        self.card_art = await self.discord_client.image_codec.decode_base64_image_bytes(base64_image[0])
 
     @staticmethod
     def get_random_artist_prompt():
@@ -288,82 +333,8 @@ class MTGCardGen:
         selected_artist = random.choice(artist_data)
         return selected_artist.get('prompt')
 
-    @staticmethod
-    async def base64_to_pil_images(base64_image):
-        """Converts a base64 images into a PIL image."""
-        img_data = base64.b64decode(base64_image)  # Decode base64 string
-        img = Image.open(io.BytesIO(img_data))  # Convert to PIL image
-
-        return img
-
-    def roll_foil(self):
-        """Rolls to see if a card is foil, and if so adds the foil texture and foil set icon"""
-        if random.randint(1, 50) == 1:
-            foil_mapping = {
-                'artifact_creature': 'assets/mtg_card_gen/foils/foil1.png',
-                'black_creature': 'assets/mtg_card_gen/foils/foil1.png',
-                'green_creature': 'assets/mtg_card_gen/foils/foil1.png',
-                'blue_creature': 'assets/mtg_card_gen/foils/foil2.png',
-                'gold_creature': 'assets/mtg_card_gen/foils/foil3.png',
-                'red_creature': 'assets/mtg_card_gen/foils/foil4.png',
-                'white_creature': 'assets/mtg_card_gen/foils/foil5.png',
-                'artifact_land': 'assets/mtg_card_gen/foils/foil1.png',
-                'black_land': 'assets/mtg_card_gen/foils/foil1.png',
-                'green_land': 'assets/mtg_card_gen/foils/foil1.png',
-                'blue_land': 'assets/mtg_card_gen/foils/foil2.png',
-                'red_land': 'assets/mtg_card_gen/foils/foil4.png',
-                'white_land': 'assets/mtg_card_gen/foils/foil5.png',
-                'black_instant': 'assets/mtg_card_gen/foils/foil1.png',
-                'green_instant': 'assets/mtg_card_gen/foils/foil1.png',
-                'blue_instant': 'assets/mtg_card_gen/foils/foil2.png',
-                'red_instant': 'assets/mtg_card_gen/foils/foil4.png',
-                'white_instant': 'assets/mtg_card_gen/foils/foil5.png',
-                'black_sorcery': 'assets/mtg_card_gen/foils/foil1.png',
-                'green_sorcery': 'assets/mtg_card_gen/foils/foil1.png',
-                'blue_sorcery': 'assets/mtg_card_gen/foils/foil2.png',
-                'red_sorcery': 'assets/mtg_card_gen/foils/foil4.png',
-                'white_sorcery': 'assets/mtg_card_gen/foils/foil5.png',
-                'black_enchant': 'assets/mtg_card_gen/foils/foil1.png',
-                'green_enchant': 'assets/mtg_card_gen/foils/foil1.png',
-                'blue_enchant': 'assets/mtg_card_gen/foils/foil2.png',
-                'red_enchant': 'assets/mtg_card_gen/foils/foil4.png',
-                'white_enchant': 'assets/mtg_card_gen/foils/foil5.png'
-            }
-            foil_image = foil_mapping.get(self.card_type, 'error')
-            with Image.open(foil_image).convert("RGBA") as foil_texture:
-                resized_foil_texture = foil_texture.resize(self.card.size)
-                self.card = ImageChops.soft_light(self.card, resized_foil_texture)
-                icon_image = Image.open("assets/mtg_card_gen/icons/foilicon.png")
-                self.card.paste(icon_image, (600, 585), icon_image)
-            return
-        server_icon = self.get_image_from_url(self.channel.guild.icon)
-        circle_icon = self.make_circle(server_icon)
-        icon_image = circle_icon.resize((42, 42))
-        #icon_image = Image.open("assets/mtg_card_gen/icons/set_icon.png")
-        self.card.paste(icon_image, (619, 579), icon_image)
-
-    def paste_title_text(self):
-        """Adds card title to a card"""
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/planewalker.otf", 36)
-        draw = ImageDraw.Draw(self.card)
-        draw.text((58, 52), self.card_title, font=font, fill="black")
-        draw.text((56, 50), self.card_title, font=font, fill="white")
-
-    def paste_artist_copyright(self):
-        """Adds artist and copyright text to a card"""
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamond.ttf", 32)
-        draw = ImageDraw.Draw(self.card)
-        draw.text((72, 942), f"Illus. {self.card_artist}", font=font, fill="black")
-        draw.text((70, 940), f"Illus. {self.card_artist}", font=font, fill="white")
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamond.ttf", 20)
-        draw.text((72, 975), f"© 1994 {self.user} - {self.channel.guild.name}", font=font, fill="black")
-        draw.text((70, 973), f"© 1994 {self.user} - {self.channel.guild.name}", font=font, fill="white")
-
-    def paste_creature_card_atk_def(self):
-        """Rolls the creature atk/def based on mana, then applies it to the card"""
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/planewalker.otf", 44)
-        draw = ImageDraw.Draw(self.card)
-
+    def roll_creature_atk_def(self):
+        """Rolls the creature atk/def based on mana"""
         if self.card_color == 'gold':
             creature_def = random.choice(range(1, self.card_primary_mana * 2))
             creature_atk = random.choice(range(0, self.card_primary_mana * 2))
@@ -380,245 +351,49 @@ class MTGCardGen:
             else:
                 creature_atk = random.choice(range(minimum_stat, self.card_primary_mana + self.card_secondary_mana))
 
-        draw.text((622, 936), f'{creature_atk}/{creature_def}', font=font, fill="black")
-        draw.text((620, 934), f'{creature_atk}/{creature_def}', font=font, fill="white")
+        return f'{creature_atk}/{creature_def}'
 
-    def paste_mana(self):
-        """Creates and adds mana icons to a card based on its color"""
-        if self.card_color in ['green', 'red', 'black', 'white', 'blue']:
-            primary_mana_image = Image.open(f"assets/mtg_card_gen/icons/{self.card_color}mana.png")
-            secondary_mana_image = Image.open(f"assets/mtg_card_gen/icons/{self.card_secondary_mana}mana.png")
+    def roll_land_mana_icon(self):
+        """Rolls the mana icon a land taps for, returning its icon file name. Legendary lands tap for more mana."""
         if self.card_color == 'artifact':
-            primary_mana_image = Image.open(f"assets/mtg_card_gen/icons/{self.card_secondary_mana + self.card_primary_mana}mana.png")
-            self.card_secondary_mana = 0
-        if self.card_color == 'gold':
-            primary_mana_image = Image.open(f"assets/mtg_card_gen/icons/{self.card_secondary_mana}mana.png")
-            secondary_mana_image = Image.open(f"assets/mtg_card_gen/icons/{self.card_secondary_mana}mana.png")
-
-        primary_mana_width, primary_mana_height = primary_mana_image.size
-        if self.card_color in ['green', 'red', 'black', 'white', 'blue']:
-            combined_mana_width = primary_mana_width + (primary_mana_width * self.card_primary_mana)
-        if self.card_color == 'artifact':
-            combined_mana_width = primary_mana_width
-        if self.card_color == 'gold':
-            combined_mana_width = primary_mana_width + (primary_mana_width * self.card_primary_mana)
-        combined_mana_image = Image.new('RGBA', (combined_mana_width, primary_mana_height))
-
-        if random.randint(0, 2) != 1:
-            use_secondary_mana = False
-        else:
-            use_secondary_mana = True
-        if use_secondary_mana:
-            if self.card_secondary_mana >= 1:
-                combined_mana_image.paste(secondary_mana_image, (0, 0))
-
-        if self.card_color in ['green', 'red', 'black', 'white', 'blue']:
-            for i in range(self.card_primary_mana):
-                combined_mana_image.paste(primary_mana_image, (primary_mana_width + i * primary_mana_width, 0))
-        if self.card_color == 'artifact':
-            combined_mana_image.paste(primary_mana_image, (0, 0))
-        if self.card_color == 'gold':
-            image_paths = [
-                'assets/mtg_card_gen/icons/redmana.png',
-                'assets/mtg_card_gen/icons/blackmana.png',
-                'assets/mtg_card_gen/icons/whitemana.png',
-                'assets/mtg_card_gen/icons/greenmana.png',
-                'assets/mtg_card_gen/icons/bluemana.png'
-            ]
-            for i in range(self.card_primary_mana):
-                primary_mana_image = Image.open(random.choice(image_paths))
-                combined_mana_image.paste(primary_mana_image, (primary_mana_width + i * primary_mana_width, 0))
-        self.card.paste(combined_mana_image, (676 - combined_mana_image.width, 49), combined_mana_image)
-
-    def paste_type(self, card_type):
-        """Adds creature type to a card"""
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamond.ttf", 36)
-        draw = ImageDraw.Draw(self.card)
-        draw.text((88, 582), card_type, font=font, fill="black")
-        draw.text((86, 580), card_type, font=font, fill="white")
-
-    def paste_ability(self, ability_file):
-        """Draws a list of words onto an image, parsing mana symbols and wrapping to a new line if the text exceeds
-        max_width."""
-        mana_mapping = {
-            '{W}': 'assets/mtg_card_gen/icons/white_mana_small.png',
-            '{U}': 'assets/mtg_card_gen/icons/blue_mana_small.png',
-            '{B}': 'assets/mtg_card_gen/icons/black_mana_small.png',
-            '{R}': 'assets/mtg_card_gen/icons/red_mana_small.png',
-            '{G}': 'assets/mtg_card_gen/icons/green_mana_small.png',
-            '{T}': 'assets/mtg_card_gen/icons/tap.png',
-            '{0}': 'assets/mtg_card_gen/icons/0_mana_small.png',
-            '{1}': 'assets/mtg_card_gen/icons/1_mana_small.png',
-            '{2}': 'assets/mtg_card_gen/icons/2_mana_small.png',
-            '{3}': 'assets/mtg_card_gen/icons/3_mana_small.png',
-            '{4}': 'assets/mtg_card_gen/icons/4_mana_small.png',
-            '{5}': 'assets/mtg_card_gen/icons/5_mana_small.png',
-            '{6}': 'assets/mtg_card_gen/icons/6_mana_small.png',
-            '{7}': 'assets/mtg_card_gen/icons/7_mana_small.png',
-            '{8}': 'assets/mtg_card_gen/icons/8_mana_small.png',
-            '{9}': 'assets/mtg_card_gen/icons/9_mana_small.png',
-            '{X}': 'assets/mtg_card_gen/icons/x_mana_small.png',
-        }
-
-        x_start, y_start = 94, 640
-        draw = ImageDraw.Draw(self.card)
-        ability_list = self.generate_abilities(ability_file)
-        pattern = r'(\{[^}]+\}|\S+|\n)'
-        words = re.findall(pattern, ability_list)
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamondbullet.ttf", 36)
-        line_height = 32
-        current_x, current_y = x_start, y_start
-
-        for word in words:
-            if word == "\n":
-                current_x = x_start  # Move to the beginning of the next line
-                current_y += line_height
-                continue
-            match = re.match(r'\{[A-Za-z0-9]\}', word)
-            if match:
-                mana_image = mana_mapping.get(match.group(0), 'error')
-                uncolored_image = Image.open(mana_image)
-                uncolored_width, uncolored_height = uncolored_image.size
-                image_bbox = (current_x, current_y, current_x + uncolored_width, current_y + uncolored_height)
-                if image_bbox[2] > 659:
-                    # If image exceeds the width, move to the next line
-                    current_x = x_start
-                    current_y += uncolored_height
-                self.card.paste(uncolored_image, (current_x, current_y), uncolored_image)
-                current_x += uncolored_width
-                continue
-            bbox = draw.textbbox((0, 0), word, font=font)
-            word_width = bbox[2] - bbox[0]
-            if current_x + word_width > 659:
-                current_x = x_start
-                current_y += line_height
-            draw.text((current_x, current_y), word, font=font, fill="black")
-            current_x += word_width + draw.textbbox((0, 0), ' ', font=font)[2]
-
-        current_x = x_start
-        current_y += line_height
-        if current_y <= 775:
-            second_words = re.findall(pattern, self.card_flavor_text)
-            second_font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamonditalic.ttf", 36)
-            for word in second_words:
-                if word == "\n":
-                    current_x = x_start
-                    current_y += line_height
-                    continue
-                bbox = draw.textbbox((0, 0), word, font=second_font)
-                word_width = bbox[2] - bbox[0]
-                if current_x + word_width > 659:
-                    current_x = x_start
-                    current_y += line_height
-                draw.text((current_x, current_y), word, font=second_font, fill="black")
-                current_x += word_width + draw.textbbox((0, 0), ' ', font=second_font)[2]
-
-    def paste_land_abilities(self):
-        """Adds land text and mana icons to a card"""
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamond.ttf", 36)
-        draw = ImageDraw.Draw(self.card)
-        draw.text((235, 668), "Tap to add", font=font, fill="black")
-        draw.text((235, 713), "to your mana pool.", font=font, fill="black")
-
-        if self.card_color == 'artifact':
-            if random.randint(1, 10) == 1:
-                base_image_path = f"assets/mtg_card_gen/icons/{random.randint(2, 4)}mana.png"
-                self.card_is_legendary = True
-            else:
-                base_image_path = f"assets/mtg_card_gen/icons/1mana.png"
-        else:
             if random.randint(1, 10) == 1:
-                base_image_path = f'assets/mtg_card_gen/icons/{random.randint(1, 4)}{self.card_color}mana.png'
                 self.card_is_legendary = True
-            else:
-                base_image_path = f'assets/mtg_card_gen/icons/{self.card_color}mana.png'
-        mana_image = Image.open(base_image_path)
-        mana_image_width, mana_image_height = mana_image.size
-        combined_mana_image = Image.new('RGBA', (mana_image_width, mana_image_height))
-        combined_mana_image.paste(mana_image, (0, 0))
-        self.card.paste(combined_mana_image, (392, 665), combined_mana_image)
-
-        x_start, y_start = 94, 760
-        ability_list = self.card_flavor_text
-        pattern = r'(\{[^}]+\}|\S+|\n)'
-        words = re.findall(pattern, ability_list)
-        font = ImageFont.truetype("assets/mtg_card_gen/fonts/garamonditalic.ttf", 36)
-        current_x, current_y = x_start, y_start
-
-        for word in words:
-            if word == "\n":
-                current_x = x_start  # Move to the beginning of the next line
-                current_y += 32
-                continue
-            bbox = draw.textbbox((0, 0), word, font=font)
-            word_width = bbox[2] - bbox[0]
-            if current_x + word_width > 659:
-                current_x = x_start
-                current_y += 32
-            draw.text((current_x, current_y), word, font=font, fill="black")
-            current_x += word_width + draw.textbbox((0, 0), ' ', font=font)[2]
-
-    def roll_signature(self):
-        """Rolls to see if a card is signed, and if so adds the signature texture"""
-        if random.randint(1, 100) == 1:
-            signature_image = 'assets/mtg_card_gen/foils/signature.png'
-            with Image.open(signature_image).convert("RGBA") as signature_texture:
-                self.card.paste(signature_texture, (100, 590), signature_texture)
-    @staticmethod
-    def get_image_from_url(url: str) -> Image.Image:
-        response = requests.get(url)
-        response.raise_for_status()  # Ensure we got a successful response
-        return Image.open(io.BytesIO(response.content))
-
-    @staticmethod
-    def make_circle(image: Image.Image) -> Image.Image:
-        size = image.size[0]  # Since it's square, width and height are the same
-
-        # Create a blank RGBA image with transparency
-        circle_image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-
-        # Create a circular mask
-        mask = Image.new("L", (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size, size), fill=255)
-
-        # Apply the mask to the image
-        circle_image.paste(image, (0, 0), mask)
-
-        return circle_image
+                return f"{random.randint(2, 4)}mana.png"
+            return "1mana.png"
+        if random.randint(1, 10) == 1:
+            self.card_is_legendary = True
+            return f"{random.randint(1, 4)}{self.card_color}mana.png"
+        return f"{self.card_color}mana.png"
 
 class MTGCardGenThreePack(MTGCardGen):
+    """This object builds three satire MTG cards at once. Each card is built on its own card object so all three can
+    be generated concurrently."""
+    card_class = MTGCardGen
+    card_count = 3
+    error_name = "MTG"
+
     async def run(self):
-        """Builds a PIL image containing a card"""
+        """Builds three cards and sends them as a pack"""
         start_time = time.time()
         try:
             now = datetime.now()
             now_string = now.strftime("%Y%m%d%H%M%S")
             sanitized_prompt = re.sub(r'[<>:"/\\|?*\x00-\x1F]', '', self.prompt)
 
-            card1 = await self.make_card()
-            dir_path_1 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_1 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card1.webp'
-            os.makedirs(os.path.dirname(dir_path_1), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_1), exist_ok=True)
-            card1.save(dir_path_1, format="WEBP")
-            card1.save(card_path_1, format="WEBP")
-
-            card2 = await self.make_card()
-            dir_path_2 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_2 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card2.webp'
-            os.makedirs(os.path.dirname(dir_path_2), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_2), exist_ok=True)
-            card2.save(dir_path_2, format="WEBP")
-            card2.save(card_path_2, format="WEBP")
-
-            card3 = await self.make_card()
-            dir_path_3 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_3 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card3.webp'
-            os.makedirs(os.path.dirname(dir_path_3), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_3), exist_ok=True)
-            card3.save(dir_path_3, format="WEBP")
-            card3.save(card_path_3, format="WEBP")
+            cards = await asyncio.gather(*(self.make_card() for _ in range(3)))
+            if None in cards:
+                raise RuntimeError("Card generation failed")
+
+            dir_paths = []
+            for card_number, card in enumerate(cards, start=1):
+                dir_path = f'assets/mtg_card_gen/users/{self.user}/{card.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
+                card_path = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card{card_number}.webp'
+                os.makedirs(os.path.dirname(dir_path), exist_ok=True)
+                os.makedirs(os.path.dirname(card_path), exist_ok=True)
+                for path in (dir_path, card_path):
+                    with open(path, "wb") as card_file:
+                        card_file.write(card.card_webp)
+                dir_paths.append(dir_path)
 
             if self.settings["discord"]["mtg_gen_three_pack_send_link"]:
                 message = await self.channel.send(f"# `{self.user}` [OPEN PACK](http://theblackgoat.net/cardflip-dynamic.html?username={self.user}&datetimestring={now_string})")
@@ -630,42 +405,29 @@ class MTGCardGenThreePack(MTGCardGen):
             elapsed_time = end_time - start_time
             await self.channel.send(
                 content=f"Card Pack for `{self.user}`: Prompt: `{self.prompt}` Time:`{elapsed_time:.2f} seconds`",
-                files=[discord.File(dir_path_1, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True),
-                       discord.File(dir_path_2, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True),
-                       discord.File(dir_path_3, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True)]
+                files=[discord.File(dir_path, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True)
+                       for dir_path in dir_paths]
             )
 
+            self.succeeded = True
             lightycard_logger.info("Card Pack Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} MTG Error: {e}")
             mtg_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
-            mtg_logger.error(f"MTG ERROR: {e}")
+            mtg_logger.error(f"{self.error_name} ERROR: {e}")
 
     async def make_card(self):
+        """Builds a single card on a fresh card object and returns it, or None if it failed"""
         try:
-            self.card_primary_mana = random.choice(range(1, 5))
-            self.card_secondary_mana = random.choice(range(0, 5))
-            self.choose_card_type()
-            self.load_card_template()
-            card_build_methods = {
-                'creature': self.build_creature_card,
-                'land': self.build_land_card,
-                'instant': self.build_instant_card,
-                'sorcery': self.build_sorcery_card,
-                'artifact': self.build_artifact_card,
-                'enchant': self.build_enchant_card,
-            }
-
-            for card_category, build_method in card_build_methods.items():
-                if self.is_card_type(card_category):
-                    await build_method()
-                    break  # Only one type should match, so we stop after the first
-
-            return self.card
+            card = self.card_class(self.discord_client, self.prompt, self.channel, self.user)
+            await card.build_card()
+            return card
         except Exception as e:
-            logger.info(f"MTG_CARD_THREE_PACK FAILURE: {e}")
+            logger.info(f"{self.error_name}_CARD_THREE_PACK FAILURE: {e}")
 
 class MTGCardGenFlux(MTGCardGen):
+    affinity_key = ("flux", None)
+
     async def generate_card_image(self, category):
         """Prepares the prompt and generates an image based on the card category."""
         self.card_artist = self.get_random_artist_prompt()
@@ -676,7 +438,7 @@ class MTGCardGenFlux(MTGCardGen):
         }
         generation_prompt = category_prompts.get(category)
         try:
-            channel_settings = SettingsLoader("configs/channels")
+            channel_settings = get_settings("configs/channels")
             lora_name = channel_settings[f"{self.channel.id}"]["flux_lora_name"]
             lora_prompt = channel_settings[f"{self.channel.id}"]["flux_lora_prompt"]
         except Exception as e:
@@ -684,19 +446,17 @@ class MTGCardGenFlux(MTGCardGen):
 
         if lora_name:
             generation_prompt = lora_prompt + generation_prompt
-            base64_image = await self.discord_client.avernus_client.flux_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               lora_name=lora_name,
-                                                                               height=512,
-                                                                               width=512)
+            base64_image = await self.discord_client.image_batcher.generate("flux_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            lora_name=lora_name,
+                                                                            height=512,
+                                                                            width=512)
         else:
-            base64_image = await self.discord_client.avernus_client.flux_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               height=512,
-                                                                               width=512)
-        image = await self.base64_to_pil_images(base64_image[0])
-        resized_image = image.resize((568, 465))
-        self.card.paste(resized_image, (88, 102))
+            base64_image = await self.discord_client.image_batcher.generate("flux_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            height=512,
+                                                                            width=512)
+        self.card_art = await self.discord_client.image_codec.decode_base64_image_bytes(base64_image[0])
 
 
     async def generate_land_image(self):
@@ -712,7 +472,7 @@ class MTGCardGenFlux(MTGCardGen):
         }
         generation_prompt = land_color_mapping.get(self.card_type)
         try:
-            channel_settings = SettingsLoader("configs/channels")
+            channel_settings = get_settings("configs/channels")
             lora_name = channel_settings[f"{self.channel.id}"]["flux_lora_name"]
             lora_prompt = channel_settings[f"{self.channel.id}"]["flux_lora_prompt"]
         except Exception as e:
@@ -720,94 +480,20 @@ class MTGCardGenFlux(MTGCardGen):
 
         if lora_name:
             generation_prompt = lora_prompt + generation_prompt
-            base64_image = await self.discord_client.avernus_client.flux_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               lora_name=lora_name,
-                                                                               height=512,
-                                                                               width=512)
+            base64_image = await self.discord_client.image_batcher.generate("flux_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            lora_name=lora_name,
+                                                                            height=512,
+                                                                            width=512)
         else:
-            base64_image = await self.discord_client.avernus_client.flux_image(generation_prompt,
-                                                                               batch_size=1,
-                                                                               height=512,
-                                                                               width=512)
-        image = await self.base64_to_pil_images(base64_image[0])
-        resized_image = image.resize((568, 465))
-        self.card.paste(resized_image, (88, 102))
-
-class MTGCardGenFluxThreePack(MTGCardGenFlux):
-    async def run(self):
-        """Builds a PIL image containing a card"""
-        start_time = time.time()
-        try:
-            now = datetime.now()
-            now_string = now.strftime("%Y%m%d%H%M%S")
-            sanitized_prompt = re.sub(r'[<>:"/\\|?*\x00-\x1F]', '', self.prompt)
-
-            card1 = await self.make_card()
-            dir_path_1 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_1 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card1.webp'
-            os.makedirs(os.path.dirname(dir_path_1), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_1), exist_ok=True)
-            card1.save(dir_path_1, format="WEBP")
-            card1.save(card_path_1, format="WEBP")
-
-            card2 = await self.make_card()
-            dir_path_2 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_2 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card2.webp'
-            os.makedirs(os.path.dirname(dir_path_2), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_2), exist_ok=True)
-            card2.save(dir_path_2, format="WEBP")
-            card2.save(card_path_2, format="WEBP")
-
-            card3 = await self.make_card()
-            dir_path_3 = f'assets/mtg_card_gen/users/{self.user}/{self.card_type}.{sanitized_prompt[:20]}.{random.randint(1, 99999999)}.webp'
-            card_path_3 = f'assets/mtg_card_gen/users/{self.user}/{now_string}/card3.webp'
-            os.makedirs(os.path.dirname(dir_path_3), exist_ok=True)
-            os.makedirs(os.path.dirname(card_path_3), exist_ok=True)
-            card3.save(dir_path_3, format="WEBP")
-            card3.save(card_path_3, format="WEBP")
-
-            if self.settings["discord"]["mtg_gen_three_pack_send_link"]:
-                message = await self.channel.send(f"# `{self.user}` [OPEN PACK](http://theblackgoat.net/cardflip-dynamic.html?username={self.user}&datetimestring={now_string})")
-                message_link = f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}"
-                lightycard_logger = logger.bind(user=f'{self.user}', prompt=self.prompt, link=message_link)
-            else:
-                lightycard_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            await self.channel.send(
-                content=f"Card Pack for `{self.user}`: Prompt: `{self.prompt}` Time:`{elapsed_time:.2f} seconds`",
-                files=[discord.File(dir_path_1, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True),
-                       discord.File(dir_path_2, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True),
-                       discord.File(dir_path_3, filename=f'lighty_mtg_{self.prompt[:20]}.png', spoiler=True)]
-            )
-
-            lightycard_logger.info("Card Pack Success")
-        except Exception as e:
-            await self.channel.send(f"{self.user.mention} MTG Error: {e}")
-            mtg_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
-            mtg_logger.error(f"MTG FLUX ERROR: {e}")
-
-    async def make_card(self):
-        try:
-            self.card_primary_mana = random.choice(range(1, 5))
-            self.card_secondary_mana = random.choice(range(0, 5))
-            self.choose_card_type()
-            self.load_card_template()
-            card_build_methods = {
-                'creature': self.build_creature_card,
-                'land': self.build_land_card,
-                'instant': self.build_instant_card,
-                'sorcery': self.build_sorcery_card,
-                'artifact': self.build_artifact_card,
-                'enchant': self.build_enchant_card,
-            }
-
-            for card_category, build_method in card_build_methods.items():
-                if self.is_card_type(card_category):
-                    await build_method()
-                    break  # Only one type should match, so we stop after the first
-
-            return self.card
-        except Exception as e:
-            logger.info(f"MTG_CARD_FLUX_THREE_PACK FAILURE: {e}")
\ No newline at end of file
+            base64_image = await self.discord_client.image_batcher.generate("flux_image", prompt=generation_prompt,
+                                                                            batch_size=1,
+                                                                            height=512,
+                                                                            width=512)
+        self.card_art = await self.discord_client.image_codec.decode_base64_image_bytes(base64_image[0])
+
+class MTGCardGenFluxThreePack(MTGCardGenThreePack):
+    """This object builds three satire Flux MTG cards at once"""
+    affinity_key = ("flux", None)
+    card_class = MTGCardGenFlux
+    error_name = "MTG FLUX"
@@ -0,0 +1,75 @@
+"""Registry of the static MTG card assets. Templates, icons, fonts, foils and ability lists are loaded and decoded
+once per process and then served from memory, so building a card does no disk I/O for static assets. Cached images
+are shared and must never be drawn on, copy them first."""
+import glob
+import json
+import os
+from functools import lru_cache
+from PIL import Image, ImageFont
+
+ASSET_PATH = "assets/mtg_card_gen"
+FONT_SIZES = {
+    "planewalker.otf": (36, 44),
+    "garamond.ttf": (20, 32, 36),
+    "garamondbullet.ttf": (36,),
+    "garamonditalic.ttf": (36,),
+}
+
+
+@lru_cache(maxsize=None)
+def load_image(path):
+    """Returns a fully decoded image"""
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+@lru_cache(maxsize=None)
+def load_rgba_image(path):
+    """Returns a fully decoded image converted to RGBA"""
+    return load_image(path).convert("RGBA")
+
+
+def load_template(card_type):
+    return load_image(f"{ASSET_PATH}/templates/{card_type}.png")
+
+
+def load_icon(icon_name):
+    return load_image(f"{ASSET_PATH}/icons/{icon_name}")
+
+
+@lru_cache(maxsize=None)
+def load_font(font_name, size):
+    return ImageFont.truetype(f"{ASSET_PATH}/fonts/{font_name}", size)
+
+
+@lru_cache(maxsize=None)
+def load_foil(foil_path, size):
+    """Returns a foil texture already converted to RGBA and resized to the card size"""
+    return load_rgba_image(foil_path).resize(size)
+
+
+@lru_cache(maxsize=None)
+def load_abilities(ability_file):
+    """Returns the list of abilities in an ability json file as a tuple"""
+    with open(f"{ASSET_PATH}/json/{ability_file}.json", 'r') as abilities_file:
+        return tuple(json.load(abilities_file))
+
+
+def preload_assets():
+    """Loads every static card asset up front. Used as the card render worker initializer so the first card each worker
+    renders is as fast as the rest."""
+    template_size = None
+    for template_path in glob.glob(f"{ASSET_PATH}/templates/*.png"):
+        template_size = load_template(os.path.splitext(os.path.basename(template_path))[0]).size
+    for icon_path in glob.glob(f"{ASSET_PATH}/icons/*.png"):
+        load_icon(os.path.basename(icon_path))
+    for font_name, sizes in FONT_SIZES.items():
+        for size in sizes:
+            load_font(font_name, size)
+    for foil_path in glob.glob(f"{ASSET_PATH}/foils/foil*.png"):
+        if template_size is not None:
+            load_foil(foil_path, template_size)
+    load_rgba_image(f"{ASSET_PATH}/foils/signature.png")
+    for ability_path in glob.glob(f"{ASSET_PATH}/json/*.json"):
+        load_abilities(os.path.splitext(os.path.basename(ability_path))[0])
@@ -0,0 +1,329 @@
+"""Renders satire MTG cards from a plain card spec dict in a process pool so PIL compositing and image encoding never
+run on the discord event loop. The card spec only holds plain python types and bytes so it can be pickled, and every
+random roll is made before rendering so a spec always renders the same card."""
+import asyncio
+import io
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from loguru import logger
+from PIL import Image, ImageDraw, ImageChops
+from modules.mtg_card_assets import (load_font, load_foil, load_icon, load_image, load_rgba_image, load_template,
+                                     preload_assets)
+
+FOIL_MAPPING = {
+    'artifact_creature': 'assets/mtg_card_gen/foils/foil1.png',
+    'black_creature': 'assets/mtg_card_gen/foils/foil1.png',
+    'green_creature': 'assets/mtg_card_gen/foils/foil1.png',
+    'blue_creature': 'assets/mtg_card_gen/foils/foil2.png',
+    'gold_creature': 'assets/mtg_card_gen/foils/foil3.png',
+    'red_creature': 'assets/mtg_card_gen/foils/foil4.png',
+    'white_creature': 'assets/mtg_card_gen/foils/foil5.png',
+    'artifact_land': 'assets/mtg_card_gen/foils/foil1.png',
+    'black_land': 'assets/mtg_card_gen/foils/foil1.png',
+    'green_land': 'assets/mtg_card_gen/foils/foil1.png',
+    'blue_land': 'assets/mtg_card_gen/foils/foil2.png',
+    'red_land': 'assets/mtg_card_gen/foils/foil4.png',
+    'white_land': 'assets/mtg_card_gen/foils/foil5.png',
+    'black_instant': 'assets/mtg_card_gen/foils/foil1.png',
+    'green_instant': 'assets/mtg_card_gen/foils/foil1.png',
+    'blue_instant': 'assets/mtg_card_gen/foils/foil2.png',
+    'red_instant': 'assets/mtg_card_gen/foils/foil4.png',
+    'white_instant': 'assets/mtg_card_gen/foils/foil5.png',
+    'black_sorcery': 'assets/mtg_card_gen/foils/foil1.png',
+    'green_sorcery': 'assets/mtg_card_gen/foils/foil1.png',
+    'blue_sorcery': 'assets/mtg_card_gen/foils/foil2.png',
+    'red_sorcery': 'assets/mtg_card_gen/foils/foil4.png',
+    'white_sorcery': 'assets/mtg_card_gen/foils/foil5.png',
+    'black_enchant': 'assets/mtg_card_gen/foils/foil1.png',
+    'green_enchant': 'assets/mtg_card_gen/foils/foil1.png',
+    'blue_enchant': 'assets/mtg_card_gen/foils/foil2.png',
+    'red_enchant': 'assets/mtg_card_gen/foils/foil4.png',
+    'white_enchant': 'assets/mtg_card_gen/foils/foil5.png'
+}
+
+MANA_MAPPING = {
+    '{W}': 'assets/mtg_card_gen/icons/white_mana_small.png',
+    '{U}': 'assets/mtg_card_gen/icons/blue_mana_small.png',
+    '{B}': 'assets/mtg_card_gen/icons/black_mana_small.png',
+    '{R}': 'assets/mtg_card_gen/icons/red_mana_small.png',
+    '{G}': 'assets/mtg_card_gen/icons/green_mana_small.png',
+    '{T}': 'assets/mtg_card_gen/icons/tap.png',
+    '{0}': 'assets/mtg_card_gen/icons/0_mana_small.png',
+    '{1}': 'assets/mtg_card_gen/icons/1_mana_small.png',
+    '{2}': 'assets/mtg_card_gen/icons/2_mana_small.png',
+    '{3}': 'assets/mtg_card_gen/icons/3_mana_small.png',
+    '{4}': 'assets/mtg_card_gen/icons/4_mana_small.png',
+    '{5}': 'assets/mtg_card_gen/icons/5_mana_small.png',
+    '{6}': 'assets/mtg_card_gen/icons/6_mana_small.png',
+    '{7}': 'assets/mtg_card_gen/icons/7_mana_small.png',
+    '{8}': 'assets/mtg_card_gen/icons/8_mana_small.png',
+    '{9}': 'assets/mtg_card_gen/icons/9_mana_small.png',
+    '{X}': 'assets/mtg_card_gen/icons/x_mana_small.png',
+}
+
+WORD_PATTERN = r'(\{[^}]+\}|\S+|\n)'
+
+
+def render_card(card_spec):
+    """Builds a card image from a card spec and returns a dict with the encoded "png" and "webp" bytes"""
+    card = load_template(card_spec['card_type']).copy()
+    paste_art(card, card_spec["art"])
+    if card_spec["is_foil"]:
+        card = paste_foil(card, card_spec["card_type"])
+    else:
+        paste_set_icon(card, card_spec["set_icon"])
+    paste_title_text(card, card_spec["title"])
+    paste_artist_copyright(card, card_spec["artist"], card_spec["user_name"], card_spec["guild_name"])
+    if card_spec["power_toughness"] is not None:
+        paste_creature_card_atk_def(card, card_spec["power_toughness"])
+    if card_spec["land_mana_icon"] is None:
+        paste_mana(card, card_spec)
+    paste_type(card, card_spec["type_line"])
+    if card_spec["land_mana_icon"] is not None:
+        paste_land_abilities(card, card_spec["land_mana_icon"], card_spec["flavor_text"])
+    else:
+        paste_ability(card, card_spec["ability_text"], card_spec["flavor_text"])
+    if card_spec["is_signed"]:
+        paste_signature(card)
+
+    with io.BytesIO() as png_buffer, io.BytesIO() as webp_buffer:
+        card.save(png_buffer, format="PNG")
+        card.save(webp_buffer, format="WEBP")
+        return {"png": png_buffer.getvalue(), "webp": webp_buffer.getvalue()}
+
+
+def paste_art(card, art):
+    """Resizes the generated art and pastes it into the card frame"""
+    with Image.open(io.BytesIO(art)) as art_image:
+        resized_image = art_image.resize((568, 465))
+    card.paste(resized_image, (88, 102))
+
+
+def paste_foil(card, card_type):
+    """Applies the foil texture and foil set icon, returning the new card image"""
+    foil_image = FOIL_MAPPING.get(card_type, 'error')
+    resized_foil_texture = load_foil(foil_image, card.size)
+    card = ImageChops.soft_light(card, resized_foil_texture)
+    icon_image = load_icon("foilicon.png")
+    card.paste(icon_image, (600, 585), icon_image)
+    return card
+
+
+def paste_set_icon(card, set_icon):
+    """Pastes the 42x42 set icon, which is the circled server icon"""
+    icon_image = Image.open(io.BytesIO(set_icon))
+    card.paste(icon_image, (619, 579), icon_image)
+
+
+def paste_title_text(card, card_title):
+    """Adds card title to a card"""
+    font = load_font("planewalker.otf", 36)
+    draw = ImageDraw.Draw(card)
+    draw.text((58, 52), card_title, font=font, fill="black")
+    draw.text((56, 50), card_title, font=font, fill="white")
+
+
+def paste_artist_copyright(card, card_artist, user_name, guild_name):
+    """Adds artist and copyright text to a card"""
+    font = load_font("garamond.ttf", 32)
+    draw = ImageDraw.Draw(card)
+    draw.text((72, 942), f"Illus. {card_artist}", font=font, fill="black")
+    draw.text((70, 940), f"Illus. {card_artist}", font=font, fill="white")
+    font = load_font("garamond.ttf", 20)
+    draw.text((72, 975), f"© 1994 {user_name} - {guild_name}", font=font, fill="black")
+    draw.text((70, 973), f"© 1994 {user_name} - {guild_name}", font=font, fill="white")
+
+
+def paste_creature_card_atk_def(card, power_toughness):
+    """Adds the creature atk/def to a card"""
+    font = load_font("planewalker.otf", 44)
+    draw = ImageDraw.Draw(card)
+    draw.text((622, 936), power_toughness, font=font, fill="black")
+    draw.text((620, 934), power_toughness, font=font, fill="white")
+
+
+def paste_mana(card, card_spec):
+    """Creates and adds mana icons to a card based on its color"""
+    card_color = card_spec["card_color"]
+    card_primary_mana = card_spec["primary_mana"]
+    card_secondary_mana = card_spec["secondary_mana"]
+    if card_color in ['green', 'red', 'black', 'white', 'blue']:
+        primary_mana_image = load_icon(f"{card_color}mana.png")
+        secondary_mana_image = load_icon(f"{card_secondary_mana}mana.png")
+    if card_color == 'artifact':
+        primary_mana_image = load_icon(f"{card_secondary_mana + card_primary_mana}mana.png")
+        card_secondary_mana = 0
+    if card_color == 'gold':
+        primary_mana_image = load_icon(f"{card_secondary_mana}mana.png")
+        secondary_mana_image = load_icon(f"{card_secondary_mana}mana.png")
+
+    primary_mana_width, primary_mana_height = primary_mana_image.size
+    if card_color in ['green', 'red', 'black', 'white', 'blue']:
+        combined_mana_width = primary_mana_width + (primary_mana_width * card_primary_mana)
+    if card_color == 'artifact':
+        combined_mana_width = primary_mana_width
+    if card_color == 'gold':
+        combined_mana_width = primary_mana_width + (primary_mana_width * card_primary_mana)
+    combined_mana_image = Image.new('RGBA', (combined_mana_width, primary_mana_height))
+
+    if card_spec["use_secondary_mana"]:
+        if card_secondary_mana >= 1:
+            combined_mana_image.paste(secondary_mana_image, (0, 0))
+
+    if card_color in ['green', 'red', 'black', 'white', 'blue']:
+        for i in range(card_primary_mana):
+            combined_mana_image.paste(primary_mana_image, (primary_mana_width + i * primary_mana_width, 0))
+    if card_color == 'artifact':
+        combined_mana_image.paste(primary_mana_image, (0, 0))
+    if card_color == 'gold':
+        for i, gold_mana_color in enumerate(card_spec["gold_mana_colors"]):
+            primary_mana_image = load_icon(f'{gold_mana_color}mana.png')
+            combined_mana_image.paste(primary_mana_image, (primary_mana_width + i * primary_mana_width, 0))
+    card.paste(combined_mana_image, (676 - combined_mana_image.width, 49), combined_mana_image)
+
+
+def paste_type(card, card_type):
+    """Adds creature type to a card"""
+    font = load_font("garamond.ttf", 36)
+    draw = ImageDraw.Draw(card)
+    draw.text((88, 582), card_type, font=font, fill="black")
+    draw.text((86, 580), card_type, font=font, fill="white")
+
+
+def paste_ability(card, ability_text, card_flavor_text):
+    """Draws a list of words onto an image, parsing mana symbols and wrapping to a new line if the text exceeds
+    max_width."""
+    x_start, y_start = 94, 640
+    draw = ImageDraw.Draw(card)
+    words = re.findall(WORD_PATTERN, ability_text)
+    font = load_font("garamondbullet.ttf", 36)
+    line_height = 32
+    current_x, current_y = x_start, y_start
+
+    for word in words:
+        if word == "\n":
+            current_x = x_start  # Move to the beginning of the next line
+            current_y += line_height
+            continue
+        match = re.match(r'\{[A-Za-z0-9]\}', word)
+        if match:
+            mana_image = MANA_MAPPING.get(match.group(0), 'error')
+            uncolored_image = load_image(mana_image)
+            uncolored_width, uncolored_height = uncolored_image.size
+            image_bbox = (current_x, current_y, current_x + uncolored_width, current_y + uncolored_height)
+            if image_bbox[2] > 659:
+                # If image exceeds the width, move to the next line
+                current_x = x_start
+                current_y += uncolored_height
+            card.paste(uncolored_image, (current_x, current_y), uncolored_image)
+            current_x += uncolored_width
+            continue
+        bbox = draw.textbbox((0, 0), word, font=font)
+        word_width = bbox[2] - bbox[0]
+        if current_x + word_width > 659:
+            current_x = x_start
+            current_y += line_height
+        draw.text((current_x, current_y), word, font=font, fill="black")
+        current_x += word_width + draw.textbbox((0, 0), ' ', font=font)[2]
+
+    current_x = x_start
+    current_y += line_height
+    if current_y <= 775:
+        second_words = re.findall(WORD_PATTERN, card_flavor_text)
+        second_font = load_font("garamonditalic.ttf", 36)
+        for word in second_words:
+            if word == "\n":
+                current_x = x_start
+                current_y += line_height
+                continue
+            bbox = draw.textbbox((0, 0), word, font=second_font)
+            word_width = bbox[2] - bbox[0]
+            if current_x + word_width > 659:
+                current_x = x_start
+                current_y += line_height
+            draw.text((current_x, current_y), word, font=second_font, fill="black")
+            current_x += word_width + draw.textbbox((0, 0), ' ', font=second_font)[2]
+
+
+def paste_land_abilities(card, land_mana_icon, card_flavor_text):
+    """Adds land text and mana icons to a card"""
+    font = load_font("garamond.ttf", 36)
+    draw = ImageDraw.Draw(card)
+    draw.text((235, 668), "Tap to add", font=font, fill="black")
+    draw.text((235, 713), "to your mana pool.", font=font, fill="black")
+
+    mana_image = load_icon(land_mana_icon)
+    mana_image_width, mana_image_height = mana_image.size
+    combined_mana_image = Image.new('RGBA', (mana_image_width, mana_image_height))
+    combined_mana_image.paste(mana_image, (0, 0))
+    card.paste(combined_mana_image, (392, 665), combined_mana_image)
+
+    x_start, y_start = 94, 760
+    words = re.findall(WORD_PATTERN, card_flavor_text)
+    font = load_font("garamonditalic.ttf", 36)
+    current_x, current_y = x_start, y_start
+
+    for word in words:
+        if word == "\n":
+            current_x = x_start  # Move to the beginning of the next line
+            current_y += 32
+            continue
+        bbox = draw.textbbox((0, 0), word, font=font)
+        word_width = bbox[2] - bbox[0]
+        if current_x + word_width > 659:
+            current_x = x_start
+            current_y += 32
+        draw.text((current_x, current_y), word, font=font, fill="black")
+        current_x += word_width + draw.textbbox((0, 0), ' ', font=font)[2]
+
+
+def paste_signature(card):
+    """Adds the signature texture to a card"""
+    signature_texture = load_rgba_image('assets/mtg_card_gen/foils/signature.png')
+    card.paste(signature_texture, (100, 590), signature_texture)
+
+
+class CardRenderer:
+    """Owns the process pool cards are rendered in"""
+    def __init__(self, max_workers=3):
+        self.max_workers: int = max_workers
+        self.executor = None
+
+    def get_executor(self):
+        """Creates the process pool on first use. Workers are started from a fork server (or spawned where there is
+        none) rather than forked from the bot, which already has threads running. The fork server preloads this
+        module so each worker starts with PIL and the renderer imported. Each worker also imports the bot entrypoint
+        as __mp_main__, which only builds the clients inside run_program, so that import is cheap."""
+        if self.executor is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("forkserver")
+                mp_context.set_forkserver_preload([__name__])
+            else:
+                mp_context = multiprocessing.get_context("spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context,
+                                                initializer=preload_assets)
+        return self.executor
+
+    def start(self):
+        """Creates the process pool. Each worker preloads its assets when it starts."""
+        self.get_executor()
+
+    async def render(self, card_spec):
+        """Renders a card spec in the process pool and returns its encoded "png" and "webp" bytes. If a worker died
+        and broke the pool, the pool is rebuilt and the card is rendered again once."""
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+        try:
+            return await loop.run_in_executor(executor, render_card, card_spec)
+        except BrokenProcessPool as e:
+            logger.warning(f"Card Render Pool Broken: {e}")
+            if self.executor is executor:
+                self.shutdown()
+            return await loop.run_in_executor(self.get_executor(), render_card, card_spec)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from loguru import logger
+
+ENHANCE_PROMPT = "Turn the following prompt into a three sentence visual description of it. Here is the prompt: {prompt}"
+
+
+class PromptEnhancer:
+    """Turns image prompts into three sentence visual descriptions with the chat LLM and keeps the results in an LRU
+    cache keyed by prompt and enhancer model, so rerolls of the same prompt skip the LLM round trip. Failed
+    enhancements are returned but not cached."""
+    def __init__(self, avernus_client, max_entries=128):
+        self.avernus_client = avernus_client
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    async def enhance(self, prompt, model_name=None, refresh=False):
+        """Returns the enhanced prompt, reusing the cached one unless refresh is set"""
+        key = (prompt, model_name)
+        if not refresh and key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        enhanced_prompt = await self.avernus_client.llm_chat(ENHANCE_PROMPT.format(prompt=prompt), model_name)
+        if isinstance(enhanced_prompt, str) and enhanced_prompt.strip():
+            self.put(key, enhanced_prompt)
+        else:
+            logger.bind(prompt=prompt, response=enhanced_prompt).warning("Prompt Enhancement Failed")
+        return enhanced_prompt
+
+    def put(self, key, enhanced_prompt):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = enhanced_prompt
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,28 @@
+import discord
+from loguru import logger
+
+
+class QueuedButtons(discord.ui.View):
+    """Class for the cancel button on the queued acknowledgement of a request"""
+    def __init__(self, discord_client, queue_request):
+        super().__init__()
+        self.timeout = None  # Disables the timeout on the buttons
+        self.discord_client = discord_client
+        self.queue_request = queue_request
+
+    @discord.ui.button(label='Cancel', emoji="✖", style=discord.ButtonStyle.grey)
+    async def cancel_request(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Cancels the request whether it is still queued or already running"""
+        if interaction.user.id != self.queue_request.user.id:
+            await interaction.response.send_message("Only the user who queued this can cancel it.", ephemeral=True,
+                                                    delete_after=5)
+            return
+        if await self.discord_client.request_queue.cancel(self.queue_request):
+            content = "Cancelled."
+        else:
+            content = "This has already finished."
+        await interaction.response.edit_message(content=content, view=None)
+        self.queue_request = None
+        self.stop()
+        cancel_logger = logger.bind(user=interaction.user.name, userid=interaction.user.id)
+        cancel_logger.info("Cancel Button")
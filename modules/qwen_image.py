@@ -1,14 +1,16 @@
-import base64
 import io
 import re
 import time
 import discord
 from loguru import logger
-from PIL import Image
-from modules.settings_loader import SettingsLoader
+from modules.queue_buttons import QueuedButtons
+from modules.settings_loader import get_settings
 
 class QwenImageGen:
     """This is the queue object for qwen-image generations"""
+    request_class = "qwen_image"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -21,8 +23,9 @@ class QwenImageGen:
                  i2i_image=None,
                  strength=None,
                  negative_prompt=None,
-                 true_cfg_scale=None):
-        self.settings = SettingsLoader("configs")
+                 true_cfg_scale=None,
+                 seed=None):
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -39,6 +42,15 @@ class QwenImageGen:
         self.i2i_image_base64 = None
         self.strength = strength
         self.true_cfg_scale = true_cfg_scale
+        self.seed = seed
+        self.affinity_key = ("qwen_image", self.lora_name)
+        if self.i2i_image is None:
+            # seeded requests only share a key with identical ones, which the image batcher deduplicates
+            self.batch_key = (type(self).__name__, self.prompt, self.negative_prompt, self.lora_name, self.width,
+                              self.height, self.true_cfg_scale, self.seed,
+                              self.batch_size if self.seed is not None else None)
+        else:
+            self.batch_key = None
 
 
     async def run(self):
@@ -66,9 +78,11 @@ class QwenImageGen:
                 kwargs["strength"] = self.strength
             if self.true_cfg_scale:
                 kwargs["true_cfg_scale"] = self.true_cfg_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
 
-            base64_images = await self.avernus_client.qwen_image_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("qwen_image_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -92,6 +106,7 @@ class QwenImageGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             qwen_image_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             qwen_image_logger.info("QWEN IMAGE Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Qwen Image Error: {e}")
@@ -107,33 +122,26 @@ class QwenImageGen:
 
         return discord_files
 
-    @staticmethod
-    async def base64_to_pil_images(base64_images):
+    async def base64_to_pil_images(self, base64_images):
         """Converts a list of base64 images into a list of file-like objects."""
-        image_files = []
-        for base64_image in base64_images:
-            img_data = base64.b64decode(base64_image)  # Decode base64 string
-            img_file = io.BytesIO(img_data)  # Convert to file-like object
-            image_files.append(img_file)
+        return await self.discord_client.image_codec.decode_base64_images(base64_images)
 
-        return image_files
-
-    @staticmethod
-    async def image_to_base64(image, width, height):
-        attachment_buffer = io.BytesIO()
-        await image.save(attachment_buffer)
-        image = Image.open(attachment_buffer)
-        image = image.convert("RGB")
-        image = image.resize((width, height))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    async def image_to_base64(self, image, width, height):
+        return await self.discord_client.image_codec.encode_attachment(image, width, height,
+                                                                       binary=self.avernus_client.binary_uploads)
 
 class QwenImageGenEnhanced(QwenImageGen):
+    """Enhances the prompt with the chat LLM before generating. Enhanced prompts are cached, so rerolls reuse the
+    previous enhancement unless refresh_enhancement is set."""
+    def __init__(self, *args, refresh_enhancement=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_enhancement = refresh_enhancement
+
     async def run(self):
         start_time = time.time()
         try:
-            enhanced_prompt = await self.avernus_client.llm_chat(f"Turn the following prompt into a three sentence visual description of it. Here is the prompt: {self.prompt}")
+            enhanced_prompt = await self.discord_client.prompt_enhancer.enhance(
+                self.prompt, self.settings["avernus"]["llm_model"], refresh=self.refresh_enhancement)
             kwargs = {"prompt": self.prompt}
             if self.negative_prompt:
                 kwargs["negative_prompt"] = self.negative_prompt
@@ -156,8 +164,10 @@ class QwenImageGenEnhanced(QwenImageGen):
                 kwargs["strength"] = self.strength
             if self.true_cfg_scale:
                 kwargs["true_cfg_scale"] = self.true_cfg_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
-            base64_images = await self.avernus_client.qwen_image_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("qwen_image_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -178,6 +188,7 @@ class QwenImageGenEnhanced(QwenImageGen):
                                               batch_size=self.batch_size,
                                               true_cfg_scale=self.true_cfg_scale))
             qwen_image_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             qwen_image_logger.info("QWEN IMAGE Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Qwen Image Error: {e}")
@@ -187,6 +198,9 @@ class QwenImageGenEnhanced(QwenImageGen):
 
 class QwenImageEditGen:
     """This is the queue object for qwen-image-edit generations"""
+    request_class = "qwen_image"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -200,7 +214,7 @@ class QwenImageEditGen:
                  strength=None,
                  negative_prompt=None,
                  true_cfg_scale=None):
-        self.settings = SettingsLoader("configs")
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -217,6 +231,7 @@ class QwenImageEditGen:
         self.i2i_image_base64 = None
         self.strength = strength
         self.true_cfg_scale = true_cfg_scale
+        self.affinity_key = ("qwen_image_edit", self.lora_name)
 
     async def run(self):
         start_time = time.time()
@@ -264,6 +279,7 @@ class QwenImageEditGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             flux_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             flux_logger.info("Qwen Image Edit Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} Qwen Image Edit Error: {e}")
@@ -279,27 +295,12 @@ class QwenImageEditGen:
 
         return discord_files
 
-    @staticmethod
-    async def base64_to_pil_images(base64_images):
+    async def base64_to_pil_images(self, base64_images):
         """Converts a list of base64 images into a list of file-like objects."""
-        image_files = []
-        for base64_image in base64_images:
-            img_data = base64.b64decode(base64_image)  # Decode base64 string
-            img_file = io.BytesIO(img_data)  # Convert to file-like object
-            image_files.append(img_file)
-
-        return image_files
+        return await self.discord_client.image_codec.decode_base64_images(base64_images)
 
-    @staticmethod
-    async def image_to_base64(image):
-        attachment_buffer = io.BytesIO()
-        await image.save(attachment_buffer)
-        image = Image.open(attachment_buffer)
-        image = image.convert("RGB")
-        #image = image.resize((width, height))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    async def image_to_base64(self, image):
+        return await self.discord_client.image_codec.encode_attachment(image, binary=self.avernus_client.binary_uploads)
 
 class QwenImageButtons(discord.ui.View):
     """Class for the ui buttons on /qwen_image_gen"""
@@ -348,9 +349,12 @@ class QwenImageButtons(discord.ui.View):
                                               negative_prompt=self.negative_prompt,
                                               true_cfg_scale=self.true_cfg_scale,
                                               )
+            size = await self.discord_client.get_queue_position(qwen_image_request)
+            eta = await self.discord_client.get_queue_eta(qwen_image_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, qwen_image_request)
             )
             qwen_image_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             qwen_image_queuelogger.info("Qwen Image Queued")
@@ -389,7 +393,15 @@ class QwenImageEnhancedButtons(QwenImageButtons):
     """Class for the prompt enhanced ui buttons on /qwen_image_gen"""
     @discord.ui.button(label='Reroll', emoji="🎲", style=discord.ButtonStyle.grey)
     async def reroll(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Rerolls last qwen image enhanced gen"""
+        """Rerolls last qwen image enhanced gen, reusing the enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=False)
+
+    @discord.ui.button(label='New Enhancement', emoji="✨", style=discord.ButtonStyle.grey)
+    async def new_enhancement(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Rerolls last qwen image enhanced gen with a newly enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=True)
+
+    async def queue_enhanced(self, interaction: discord.Interaction, refresh_enhancement):
         if await self.discord_client.is_room_in_queue(interaction.user.id):
             qwen_image_request = QwenImageGenEnhanced(self.discord_client,
                                                       self.prompt,
@@ -403,10 +415,14 @@ class QwenImageEnhancedButtons(QwenImageButtons):
                                                       strength=self.strength,
                                                       negative_prompt=self.negative_prompt,
                                                       true_cfg_scale=self.true_cfg_scale,
+                                                      refresh_enhancement=refresh_enhancement,
                                                       )
+            size = await self.discord_client.get_queue_position(qwen_image_request)
+            eta = await self.discord_client.get_queue_eta(qwen_image_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, qwen_image_request)
             )
             qwen_image_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             qwen_image_queuelogger.info("Qwen Image Queued")
@@ -435,9 +451,12 @@ class QwenImageEditButtons(QwenImageButtons):
                                                        strength=self.strength,
                                                        negative_prompt=self.negative_prompt,
                                                        true_cfg_scale=self.true_cfg_scale)
+            size = await self.discord_client.get_queue_position(qwen_image_edit_request)
+            eta = await self.discord_client.get_queue_eta(qwen_image_edit_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, qwen_image_edit_request)
             )
             qwen_image_edit_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             qwen_image_edit_queuelogger.info("Qwen Image Edit Queued")
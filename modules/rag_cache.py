@@ -0,0 +1,57 @@
+import re
+import time
+from collections import OrderedDict
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Lowercases a prompt, drops punctuation and collapses whitespace so near identical questions share a key"""
+    prompt = PUNCTUATION_PATTERN.sub(" ", str(prompt).lower())
+    return WHITESPACE_PATTERN.sub(" ", prompt).strip()
+
+
+class RagCache:
+    """Size bounded LRU cache of RAG results. Entries are keyed on the normalized prompt plus the retrieval settings
+    and expire ttl seconds after they were stored. Hits and misses are counted so the hit rate can be checked. Call
+    clear() when the RAG documents on avernus change."""
+    def __init__(self, max_entries=256, ttl=600.0):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def make_key(prompt, max_candidates, similarity_threshold):
+        return normalize_prompt(prompt), max_candidates, similarity_threshold
+
+    def get(self, key):
+        """Returns the cached results for key, or None if there are none or they have expired"""
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, results):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic(), results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every cached result, returning how many were dropped"""
+        flushed = len(self.entries)
+        self.entries.clear()
+        return flushed
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
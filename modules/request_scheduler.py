@@ -0,0 +1,374 @@
+import asyncio
+import time
+from loguru import logger
+
+
+def get_request_class(request):
+    """Returns the request class of a queue object, used to look up its concurrency limit"""
+    return getattr(request, "request_class", "default")
+
+
+def get_affinity_key(request):
+    """Returns the pipeline/model/lora a queue object needs loaded on avernus, or None if it doesnt care"""
+    return getattr(request, "affinity_key", None)
+
+
+def get_batch_key(request):
+    """Returns the key a queue object can be merged into a single avernus call with, or None if it cant be"""
+    return getattr(request, "batch_key", None)
+
+
+def get_dedup_key(request):
+    """Returns the key a seeded queue object shares with identical ones, which the image batcher deduplicates into a
+    single avernus call, or None if it is not seeded"""
+    if getattr(request, "seed", None) is None:
+        return None
+    return get_batch_key(request)
+
+
+def get_user_id(request):
+    """Returns the id of the user a queue object belongs to, or None if it has no user"""
+    user = getattr(request, "user", None)
+    return getattr(user, "id", None)
+
+
+DEFAULT_CLASS_COSTS = {"llm": 5.0, "sdxl": 3.0, "flux": 10.0, "qwen_image": 12.0, "ace": 2.0, "mtg": 20.0}
+
+
+def get_work_units(request):
+    """Returns how much work a queue object is. Image requests are batch size x megapixels, music is seconds of audio,
+    card requests are the number of cards and everything else is one."""
+    request_class = get_request_class(request)
+    if request_class == "ace":
+        return getattr(request, "length", None) or 30
+    if request_class == "mtg":
+        return getattr(request, "card_count", 1)
+    if request_class == "llm":
+        return 1
+    batch_size = getattr(request, "batch_size", None) or 1
+    width = getattr(request, "width", None) or 1024
+    height = getattr(request, "height", None) or 1024
+    return batch_size * (width * height) / (1024 * 1024)
+
+
+def estimate_cost(request, class_costs):
+    """Estimates how many seconds a queue object takes from the work units and the seconds per unit of its class"""
+    return get_work_units(request) * class_costs.get(get_request_class(request), 1.0)
+
+
+class RequestScheduler:
+    """Runs queue objects on a pool of workers. Each request class (llm, sdxl, ace, etc) has its own concurrency limit
+    so cheap requests like chat do not have to wait behind long running gpu requests.
+
+    Within a small window at the front of the queue, requests that use the model already loaded on avernus are run
+    first to avoid model swaps. A request can only be passed over affinity_max_skips times so nothing starves. Chat
+    requests set no affinity key since the llm stays loaded alongside the image pipelines, so a chat never changes
+    which pipeline the scheduler thinks is loaded.
+
+    Pending requests that share a batch key with the request being started are started alongside it, so the image
+    batcher can merge their avernus calls into one. The group takes a single class slot. A seeded request identical
+    to one that started less than share_window seconds ago is started straight away even if its class has no free
+    slot. The image batcher keeps the images of a seeded call for the same time, so the new request shares the
+    running call or its finished images instead of rendering them again once a slot frees up. Like batch companions,
+    these sharing requests do not take up a class slot.
+
+    Users get a fair share of each request class with weighted fair queueing. Every request is tagged with a virtual
+    finish time of max(virtual time, the users last finish time) + its estimated cost, and requests run in order of
+    finish time rather than arrival. A user who queues several large batches only delays the next user by one of them.
+    A users last finish time is rolled back when they cancel a request and forgotten once they have nothing pending or
+    running.
+
+    With a cost model, costs are the learned run times, every request that ran on its own and set its succeeded flag
+    teaches the model, and estimate_wait gives the expected wait for a new request.
+
+    With a job journal, every request is journaled before it is queued and its record is removed once it finishes.
+
+    Requests can be cancelled. A pending request is dropped, and a running request has its task cancelled, which
+    also aborts its in flight avernus call. Either way its slot is released and on_request_done is called as usual.
+    A request cancelled after its queued message was sent but before put finished is dropped by put, so the cancel
+    button works from the moment it is shown."""
+    def __init__(self, workers=4, class_limits=None, default_class_limit=1, on_request_done=None, affinity_window=5,
+                 affinity_max_skips=3, max_batch_size=10, class_costs=None, cost_model=None, journal=None,
+                 share_window=60.0):
+        self.workers: int = workers
+        self.class_limits: dict = class_limits or {}
+        self.default_class_limit: int = default_class_limit
+        self.on_request_done = on_request_done
+        self.pending: list = []
+        self.running: list = []
+        self.running_counts: dict = {}
+        self.condition: asyncio.Condition = asyncio.Condition()
+        self.worker_tasks: list = []
+        self.affinity_window: int = affinity_window
+        self.affinity_max_skips: int = affinity_max_skips
+        self.skip_counts: dict = {}
+        self.loaded_affinity_key = None
+        self.model_swaps: int = 0
+        self.swaps_avoided: int = 0
+        self.max_batch_size: int = max_batch_size
+        self.class_costs: dict = {**DEFAULT_CLASS_COSTS, **(class_costs or {})}
+        self.virtual_time: float = 0.0
+        self.user_finish_times: dict = {}
+        self.finish_times: dict = {}
+        self.arrival_count: int = 0
+        self.cost_model = cost_model
+        self.started_at: dict = {}
+        self.journal = journal
+        self.running_tasks: dict = {}
+        self.sharing: set = set()
+        self.share_window: float = share_window
+
+    def start(self):
+        """Spawns the worker tasks on the running loop"""
+        for _ in range(self.workers):
+            self.worker_tasks.append(asyncio.create_task(self.worker()))
+
+    async def put(self, request):
+        """Journals a queue object, tags it with its virtual finish time, adds it to the pending list and wakes a
+        worker. A request cancelled before it got here is dropped instead."""
+        if self.journal is not None and not getattr(request, "cancelled", False):
+            await self.journal.record(request)
+        async with self.condition:
+            cancelled = getattr(request, "cancelled", False)
+            if not cancelled:
+                start_time, finish_time = self.fair_share_tags(request)
+                self.user_finish_times[get_user_id(request)] = finish_time
+                self.arrival_count += 1
+                self.finish_times[id(request)] = (start_time, finish_time, self.arrival_count)
+                self.pending.append(request)
+                self.condition.notify_all()
+        if cancelled:
+            await self.finish_cancelled(request)
+
+    def fair_share_tags(self, request):
+        """Returns the virtual start and finish time a queue object would get if it were queued now"""
+        start_time = self.virtual_finish_time(get_user_id(request))
+        return start_time, start_time + self.estimate(request)
+
+    def estimate(self, request):
+        """Returns the expected run time of a queue object in seconds"""
+        if self.cost_model is not None:
+            return self.cost_model.estimate(request)
+        return estimate_cost(request, self.class_costs)
+
+    def estimate_wait(self, request):
+        """Returns how many seconds a queue object would take to finish if it were queued now: the estimated time left
+        on running requests of its class and of the requests that would run before it, spread over the class slots,
+        plus its own run time"""
+        request_class = get_request_class(request)
+        _, finish_time = self.fair_share_tags(request)
+        now = time.monotonic()
+        queued_seconds = sum(self.estimate(pending_request) for pending_request in self.pending
+                             if get_request_class(pending_request) == request_class and
+                             self.finish_times[id(pending_request)][1] <= finish_time)
+        running_seconds = sum(max(self.estimate(running_request) - (now - self.started_at[id(running_request)]), 0.0)
+                              for running_request in self.running
+                              if get_request_class(running_request) == request_class)
+        return (queued_seconds + running_seconds) / max(self.class_limit(request_class), 1) + self.estimate(request)
+
+    def virtual_finish_time(self, user_id):
+        """Returns the virtual finish time of the users newest queued request, or the current virtual time if they
+        have nothing queued. Their next request starts at this virtual time, which is what queue positions and ETAs
+        are worked out from."""
+        return max(self.virtual_time, self.user_finish_times.get(user_id, 0.0))
+
+    def position(self, request):
+        """Returns how many requests of the same class would run before this one if it were queued now"""
+        request_class = get_request_class(request)
+        _, finish_time = self.fair_share_tags(request)
+        ahead = sum(1 for pending_request in self.pending
+                    if get_request_class(pending_request) == request_class and
+                    self.finish_times[id(pending_request)][1] <= finish_time)
+        return ahead + self.running_counts.get(request_class, 0)
+
+    def fair_share_order(self, request):
+        _, finish_time, arrival = self.finish_times[id(request)]
+        return finish_time, arrival
+
+    def user_requests(self, user_id):
+        """Returns the users pending and running requests"""
+        return [request for request in self.pending + self.running if get_user_id(request) == user_id]
+
+    async def cancel(self, request):
+        """Cancels a queue object, returning False if it has already finished. A request that has been acknowledged
+        but not put on the queue yet is flagged so put drops it."""
+        async with self.condition:
+            if getattr(request, "finished", False):
+                return False
+            request.cancelled = True
+            if request in self.running:
+                if id(request) in self.running_tasks:
+                    self.running_tasks[id(request)].cancel()
+                return True
+            if request not in self.pending:
+                return True
+            self.pending.remove(request)
+            self.finish_times.pop(id(request), None)
+            self.skip_counts.pop(id(request), None)
+            self.reset_user_finish_time(get_user_id(request))
+            self.condition.notify_all()
+        await self.finish_cancelled(request)
+        return True
+
+    async def finish_cancelled(self, request):
+        """Releases a cancelled queue object that never started running"""
+        request.finished = True
+        logger.bind(request=type(request).__name__, user=get_user_id(request)).info("Request Cancelled")
+        if self.on_request_done is not None:
+            self.on_request_done(request)
+        if self.journal is not None:
+            await self.journal.complete(request)
+
+    def reset_user_finish_time(self, user_id):
+        """Sets a users last finish time to the latest finish time of their pending and running requests, dropping it
+        if they have none"""
+        finish_times = [self.finish_times[id(request)][1] for request in self.user_requests(user_id)]
+        if finish_times:
+            self.user_finish_times[user_id] = max(finish_times)
+        else:
+            self.user_finish_times.pop(user_id, None)
+
+    def class_limit(self, request_class):
+        return self.class_limits.get(request_class, self.default_class_limit)
+
+    def has_capacity(self, request_class):
+        return self.running_counts.get(request_class, 0) < self.class_limit(request_class)
+
+    def next_request(self):
+        """Returns the next request to run. This is the pending request with the earliest virtual finish time whose
+        class has a free slot, unless a request a little further back uses the model that is already loaded and the
+        first has not been skipped too often. A seeded request identical to a running one is returned first whether
+        or not its class has a free slot."""
+        shared_keys = self.shared_keys()
+        if shared_keys:
+            for request in sorted(self.pending, key=self.fair_share_order):
+                if get_dedup_key(request) in shared_keys:
+                    return request
+        eligible = sorted((request for request in self.pending if self.has_capacity(get_request_class(request))),
+                          key=self.fair_share_order)
+        if not eligible:
+            return None
+        head = eligible[0]
+        head_key = get_affinity_key(head)
+        if (head_key is None or head_key == self.loaded_affinity_key or self.loaded_affinity_key is None or
+                self.skip_counts.get(id(head), 0) >= self.affinity_max_skips):
+            return head
+        for index, request in enumerate(eligible[1:self.affinity_window], start=1):
+            if get_affinity_key(request) == self.loaded_affinity_key:
+                for skipped in eligible[:index]:
+                    self.skip_counts[id(skipped)] = self.skip_counts.get(id(skipped), 0) + 1
+                self.swaps_avoided += 1
+                affinity_logger = logger.bind(model=self.loaded_affinity_key, swaps_avoided=self.swaps_avoided,
+                                              model_swaps=self.model_swaps)
+                affinity_logger.info("Model Swap Avoided")
+                return request
+        return head
+
+    def mark_started(self, request):
+        """Advances the virtual time and tracks which model avernus will have loaded once this request starts"""
+        self.skip_counts.pop(id(request), None)
+        start_time, _, _ = self.finish_times[id(request)]
+        self.virtual_time = max(self.virtual_time, start_time)
+        affinity_key = get_affinity_key(request)
+        if affinity_key is None:
+            return
+        if self.loaded_affinity_key is not None and affinity_key != self.loaded_affinity_key:
+            self.model_swaps += 1
+            swap_logger = logger.bind(old_model=self.loaded_affinity_key, model=affinity_key,
+                                      model_swaps=self.model_swaps, swaps_avoided=self.swaps_avoided)
+            swap_logger.info("Model Swap")
+        self.loaded_affinity_key = affinity_key
+
+    def shared_keys(self):
+        """Returns the dedup keys of running seeded requests that took a slot and started less than share_window
+        seconds ago, whose avernus call or finished images the image batcher can still share"""
+        now = time.monotonic()
+        return {get_dedup_key(request) for request in self.running
+                if id(request) not in self.sharing and now - self.started_at[id(request)] < self.share_window} - {None}
+
+    def shares_running_call(self, request):
+        """Returns whether a seeded queue object is identical to a running one and can share its avernus call"""
+        return get_dedup_key(request) in self.shared_keys()
+
+    def batch_companions(self, request):
+        """Returns the pending requests that can be merged with this one without going over max_batch_size. A merged
+        group is a single avernus call, so it takes one slot of its class: this request takes the slot and its
+        companions run alongside it without one."""
+        batch_key = get_batch_key(request)
+        if batch_key is None:
+            return []
+        companions = []
+        total_batch_size = getattr(request, "batch_size", None) or 1
+        for pending_request in self.pending:
+            if pending_request is request or get_batch_key(pending_request) != batch_key:
+                continue
+            batch_size = getattr(pending_request, "batch_size", None) or 1
+            if total_batch_size + batch_size > self.max_batch_size:
+                break
+            companions.append(pending_request)
+            total_batch_size += batch_size
+        return companions
+
+    async def worker(self):
+        """Takes requests off the pending list and runs them"""
+        while True:
+            async with self.condition:
+                request = self.next_request()
+                while request is None:
+                    await self.condition.wait()
+                    request = self.next_request()
+                group = [request] + self.batch_companions(request)
+                for group_request in group:
+                    request_class = get_request_class(group_request)
+                    if group_request is not request or self.shares_running_call(group_request):
+                        self.sharing.add(id(group_request))
+                    else:
+                        self.running_counts[request_class] = self.running_counts.get(request_class, 0) + 1
+                    self.pending.remove(group_request)
+                    self.mark_started(group_request)
+                    self.running.append(group_request)
+                    self.started_at[id(group_request)] = time.monotonic()
+            await asyncio.gather(*(self.run_request(group_request,
+                                                    learn=len(group) == 1 and id(group_request) not in self.sharing)
+                                   for group_request in group))
+
+    async def run_request(self, request, learn=True):
+        """Runs a single queue object and releases its slot when it is done. Merged requests share one avernus call so
+        only requests that ran on their own are used to teach the cost model, and only if they succeeded, since queue
+        objects report their own errors and a failed run says nothing about how long a real one takes."""
+        task = asyncio.create_task(request.run())
+        self.running_tasks[id(request)] = task
+        if getattr(request, "cancelled", False):
+            task.cancel()
+        try:
+            await task
+            if learn and self.cost_model is not None and getattr(request, "succeeded", False):
+                self.cost_model.record(request, time.monotonic() - self.started_at[id(request)])
+                if self.cost_model.due_for_save():
+                    await asyncio.to_thread(self.cost_model.write, self.cost_model.snapshot())
+        except asyncio.CancelledError:
+            if not getattr(request, "cancelled", False):
+                raise
+            logger.bind(request=type(request).__name__, user=get_user_id(request)).info("Request Cancelled")
+        except Exception as e:
+            logger.error(f"Exception: {e}")
+        finally:
+            async with self.condition:
+                request.finished = True
+                self.running_tasks.pop(id(request), None)
+                self.started_at.pop(id(request), None)
+                self.running.remove(request)
+                self.finish_times.pop(id(request), None)
+                self.reset_user_finish_time(get_user_id(request))
+                if id(request) in self.sharing:
+                    self.sharing.discard(id(request))
+                else:
+                    self.running_counts[get_request_class(request)] -= 1
+                self.condition.notify_all()
+            if self.on_request_done is not None:
+                self.on_request_done(request)
+            if self.journal is not None:
+                try:
+                    await self.journal.complete(request)
+                except Exception as e:
+                    logger.error(f"Journal exception: {e}")
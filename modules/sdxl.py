@@ -1,14 +1,16 @@
-import base64
 import io
 import re
 import time
 import discord
 from loguru import logger
-from PIL import Image
-from modules.settings_loader import SettingsLoader
+from modules.queue_buttons import QueuedButtons
+from modules.settings_loader import get_settings
 
 class SDXLGen:
     """This is the queue object for sdxl generations"""
+    request_class = "sdxl"
+    succeeded = False
+
     def __init__(self,
                  discord_client,
                  prompt,
@@ -27,8 +29,9 @@ class SDXLGen:
                  control_processor=None,
                  control_image=None,
                  control_strength=None,
-                 guidance_scale=None):
-        self.settings = SettingsLoader("configs")
+                 guidance_scale=None,
+                 seed=None):
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.avernus_client = discord_client.avernus_client
         self.prompt = prompt
@@ -53,6 +56,15 @@ class SDXLGen:
         self.control_image_base64 = None
         self.control_strength = control_strength
         self.guidance_scale = guidance_scale
+        self.seed = seed
+        self.affinity_key = ("sdxl", self.model_name, self.lora_name)
+        if self.i2i_image is None and self.ipadapter_image is None and self.control_image is None:
+            # seeded requests only share a key with identical ones, which the image batcher deduplicates
+            self.batch_key = (type(self).__name__, self.prompt, self.negative_prompt, self.model_name, self.lora_name,
+                              self.width, self.height, self.guidance_scale, self.seed,
+                              self.batch_size if self.seed is not None else None)
+        else:
+            self.batch_key = None
 
     async def run(self):
         start_time = time.time()
@@ -92,8 +104,10 @@ class SDXLGen:
                 kwargs["controlnet_strength"] = self.control_strength
             if self.guidance_scale:
                 kwargs["guidance_scale"] = self.guidance_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
-            base64_images = await self.avernus_client.sdxl_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("sdxl_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -123,6 +137,7 @@ class SDXLGen:
             except Exception as e:
                 logger.error(f"CHANNEL SEND ERROR: {e}")
             sdxl_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             sdxl_logger.info("SDXL Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} SDXL Error: {e}")
@@ -138,34 +153,27 @@ class SDXLGen:
 
         return discord_files
 
-    @staticmethod
-    async def base64_to_pil_images(base64_images):
+    async def base64_to_pil_images(self, base64_images):
         """Converts a list of base64 images into a list of file-like objects."""
-        image_files = []
-        for base64_image in base64_images:
-            img_data = base64.b64decode(base64_image)  # Decode base64 string
-            img_file = io.BytesIO(img_data)  # Convert to file-like object
-            image_files.append(img_file)
-
-        return image_files
+        return await self.discord_client.image_codec.decode_base64_images(base64_images)
 
-    @staticmethod
-    async def image_to_base64(image, width, height):
-        attachment_buffer = io.BytesIO()
-        await image.save(attachment_buffer)
-        image = Image.open(attachment_buffer)
-        image = image.convert("RGB")
-        image = image.resize((width, height))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    async def image_to_base64(self, image, width, height):
+        return await self.discord_client.image_codec.encode_attachment(image, width, height,
+                                                                       binary=self.avernus_client.binary_uploads)
 
 
 class SDXLGenEnhanced(SDXLGen):
+    """Enhances the prompt with the chat LLM before generating. Enhanced prompts are cached, so rerolls reuse the
+    previous enhancement unless refresh_enhancement is set."""
+    def __init__(self, *args, refresh_enhancement=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_enhancement = refresh_enhancement
+
     async def run(self):
         start_time = time.time()
         try:
-            enhanced_prompt = await self.avernus_client.llm_chat(f"Turn the following prompt into a three sentence visual description of it. Here is the prompt: {self.prompt}")
+            enhanced_prompt = await self.discord_client.prompt_enhancer.enhance(
+                self.prompt, self.settings["avernus"]["llm_model"], refresh=self.refresh_enhancement)
             kwargs = {"prompt": self.prompt,
                       "negative_prompt": self.negative_prompt}
             if self.height:
@@ -201,8 +209,10 @@ class SDXLGenEnhanced(SDXLGen):
                 kwargs["controlnet_strength"] = self.control_strength
             if self.guidance_scale:
                 kwargs["guidance_scale"] = self.guidance_scale
+            if self.seed is not None:
+                kwargs["seed"] = self.seed
 
-            base64_images = await self.avernus_client.sdxl_image(**kwargs)
+            base64_images = await self.discord_client.image_batcher.generate("sdxl_image", **kwargs)
             images = await self.base64_to_pil_images(base64_images)
             files = await self.images_to_discord_files(images)
             end_time = time.time()
@@ -229,6 +239,7 @@ class SDXLGenEnhanced(SDXLGen):
                                          control_strength=self.control_strength,
                                          guidance_scale=self.guidance_scale))
             sdxl_logger = logger.bind(user=f'{self.user}', prompt=self.prompt)
+            self.succeeded = True
             sdxl_logger.info("SDXL Success")
         except Exception as e:
             await self.channel.send(f"{self.user.mention} SDXL Error: {e}")
@@ -300,9 +311,12 @@ class SDXLButtons(discord.ui.View):
                                    control_processor=self.control_processor,
                                    control_strength=self.control_strength,
                                    guidance_scale=self.guidance_scale)
+            size = await self.discord_client.get_queue_position(sdxl_request)
+            eta = await self.discord_client.get_queue_eta(sdxl_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, sdxl_request)
             )
             sdxl_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             sdxl_queuelogger.info("SDXL Queued")
@@ -341,7 +355,15 @@ class SDXLEnhancedButtons(SDXLButtons):
     """Class for the prompt enhanced ui buttons on /sdxl_gen"""
     @discord.ui.button(label='Reroll', emoji="🎲", style=discord.ButtonStyle.grey)
     async def reroll(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Rerolls last SDXL enhanced gen"""
+        """Rerolls last SDXL enhanced gen, reusing the enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=False)
+
+    @discord.ui.button(label='New Enhancement', emoji="✨", style=discord.ButtonStyle.grey)
+    async def new_enhancement(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Rerolls last SDXL enhanced gen with a newly enhanced prompt"""
+        await self.queue_enhanced(interaction, refresh_enhancement=True)
+
+    async def queue_enhanced(self, interaction: discord.Interaction, refresh_enhancement):
         if await self.discord_client.is_room_in_queue(interaction.user.id):
             sdxl_request = SDXLGenEnhanced(self.discord_client,
                                            self.prompt,
@@ -360,10 +382,14 @@ class SDXLEnhancedButtons(SDXLButtons):
                                            control_image=self.control_image,
                                            control_processor=self.control_processor,
                                            control_strength=self.control_strength,
-                                           guidance_scale=self.guidance_scale)
+                                           guidance_scale=self.guidance_scale,
+                                           refresh_enhancement=refresh_enhancement)
+            size = await self.discord_client.get_queue_position(sdxl_request)
+            eta = await self.discord_client.get_queue_eta(sdxl_request)
             await interaction.response.send_message(
-                f"Rerolling: {self.discord_client.request_queue.qsize()} requests in queue ahead of you.",
-                ephemeral=True
+                f"Rerolling: {size} requests in queue ahead of you. ETA:`{eta}`",
+                ephemeral=True,
+                view=QueuedButtons(self.discord_client, sdxl_request)
             )
             sdxl_queuelogger = logger.bind(user=interaction.user.name, prompt=self.prompt)
             sdxl_queuelogger.info("SDXL Queued")
@@ -1,5 +1,8 @@
 import json
 import os
+import threading
+import time
+from loguru import logger
 
 class SettingsLoader:
     def __init__(self, directory):
@@ -20,7 +23,10 @@ class SettingsLoader:
         """Loads a single JSON file and stores it under its filename (without extension)."""
         base_name = os.path.splitext(os.path.basename(filepath))[0]  # Get filename without extension
         with open(filepath, "r", encoding="utf-8") as f:
-            self.configs[base_name] = json.load(f)
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError(f"Config '{filepath}' must contain a JSON object.")
+        self.configs[base_name] = config
 
     def get(self, filename, key, default=None):
         """Fetches a key from the specified config file, returning default if not found."""
@@ -34,4 +40,54 @@ class SettingsLoader:
 
     def list_configs(self):
         """Returns a list of loaded config names."""
-        return list(self.configs.keys())
\ No newline at end of file
+        return list(self.configs.keys())
+
+
+_shared_settings = {}
+_shared_settings_lock = threading.Lock()
+
+
+def get_settings(directory, check_interval=1.0):
+    """Returns the shared settings snapshot for a directory. The JSON files are only parsed and validated again when
+    one of them is added, removed or modified, which is checked at most once every check_interval seconds, and the new
+    snapshot replaces the old one in a single swap. If a changed file fails to load, for example because it is half
+    written, the previous snapshot is kept. Snapshots are shared so they must be treated as read only."""
+    shared = _shared_settings.get(directory)
+    now = time.monotonic()
+    if shared is not None and now - shared["checked_at"] < check_interval:
+        return shared["settings"]
+    with _shared_settings_lock:
+        shared = _shared_settings.get(directory)
+        if shared is not None and now - shared["checked_at"] < check_interval:
+            return shared["settings"]
+        signature = get_directory_signature(directory)
+        if shared is not None and signature in (shared["signature"], shared.get("failed_signature")):
+            shared["checked_at"] = now
+            return shared["settings"]
+        try:
+            settings = SettingsLoader(directory)
+        except (OSError, ValueError) as e:
+            if shared is None:
+                raise
+            settings_logger = logger.bind(directory=directory)
+            settings_logger.warning(f"Settings Reload Failed: {e}")
+            shared["failed_signature"] = signature
+            shared["checked_at"] = now
+            return shared["settings"]
+        if shared is not None:
+            logger.bind(directory=directory).info("Settings Reloaded")
+        _shared_settings[directory] = {"settings": settings, "signature": signature, "checked_at": now}
+        return settings
+
+
+def get_directory_signature(directory):
+    """Returns the name, modification time and size of every JSON file in a directory"""
+    if not os.path.exists(directory):
+        raise FileNotFoundError(f"Directory '{directory}' not found.")
+    signature = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
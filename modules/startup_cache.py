@@ -0,0 +1,30 @@
+import json
+import os
+from loguru import logger
+
+
+class StartupCache:
+    """Small JSON file holding what the bot learned on its last start: the lora and controlnet lists avernus offered,
+    and a hash of the last slash command tree synced to discord. It lets a restart skip waiting on avernus and skip
+    resyncing unchanged commands. The file is replaced atomically so a crash never leaves it half written."""
+    def __init__(self, path="configs/cache/startup.json"):
+        self.path: str = path
+
+    def load(self):
+        """Returns the cached data, or an empty dict if there is no usable cache"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.bind(path=self.path).warning(f"Startup Cache Unreadable: {e}")
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=2)
+        os.replace(temp_path, self.path)
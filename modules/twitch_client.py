@@ -5,14 +5,14 @@ import urllib.parse
 import requests
 import time
 from loguru import logger
-from modules.settings_loader import SettingsLoader
+from modules.settings_loader import get_settings
 from modules.mtg_card import MTGCardGenThreePack
 should_reconnect = asyncio.Event()
 
 
 class TwitchEventSubClient:
     def __init__(self, discord_client):
-        self.settings = SettingsLoader("configs")
+        self.settings = get_settings("configs")
         self.discord_client = discord_client
         self.twitch_eventsub_websocket = "wss://eventsub.wss.twitch.tv/ws"
 
@@ -60,7 +60,7 @@ class TwitchEventSubClient:
         url = "https://api.twitch.tv/helix/eventsub/subscriptions"
 
         async def attempt_subscription():
-            self.settings = SettingsLoader("configs")
+            self.settings = get_settings("configs")
             headers = {
                 "Authorization": f"Bearer {self.settings['twitch']['channel_token']}",
                 "Client-Id": self.settings["twitch"]["client_id"],
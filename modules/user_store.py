@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+class UserStore:
+    """SQLite store for per user state: bans, chat history and user settings. The database runs in WAL mode and every
+    query runs on a single dedicated thread, so the connection is never shared between threads and the event loop never
+    waits on disk. On start, user JSON files from the old configs/users layout are imported once.
+
+    Banned user ids are also kept in memory so ban checks never touch the database. Bans are written through to the
+    database before the in memory set changes."""
+    def __init__(self, path="configs/users/users.db", json_dir="configs/users"):
+        self.path: str = path
+        self.json_dir: str = json_dir
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user_store")
+        self.connection = None
+        self.banned_users: set = set()
+
+    async def run(self, func, *args):
+        """Runs func on the store thread"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def start(self):
+        await self.run(self.open)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS bans (
+                    user_id TEXT PRIMARY KEY,
+                    banned_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    tokens INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id);
+                CREATE TABLE IF NOT EXISTS user_settings (
+                    user_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (user_id, key)
+                );
+                CREATE TABLE IF NOT EXISTS migrated_files (
+                    file_name TEXT PRIMARY KEY
+                );
+            """)
+            history_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(history)")}
+            if "tokens" not in history_columns:
+                self.connection.execute("ALTER TABLE history ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0")
+        self.migrate_json_files()
+        self.banned_users = {row[0] for row in self.connection.execute("SELECT user_id FROM bans")}
+
+    def migrate_json_files(self):
+        """Imports bans, history and any other keys from configs/users/<id>.json files that have not been imported yet.
+        The files are left in place."""
+        if not os.path.isdir(self.json_dir):
+            return
+        migrated_files = {row[0] for row in self.connection.execute("SELECT file_name FROM migrated_files")}
+        for file_name in sorted(os.listdir(self.json_dir)):
+            if not file_name.endswith(".json") or file_name in migrated_files:
+                continue
+            user_id = os.path.splitext(file_name)[0]
+            try:
+                with open(os.path.join(self.json_dir, file_name), "r", encoding="utf-8") as file:
+                    user_data = json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                user_data = {}
+                logger.bind(file=file_name).warning(f"User File Migration Skipped: {e}")
+            if not isinstance(user_data, dict):
+                user_data = {}
+            history = self.valid_history(file_name, user_data.get("history", []))
+            now = time.time()
+            with self.connection:
+                if user_data.get("banned", False):
+                    self.connection.execute("INSERT OR REPLACE INTO bans (user_id, banned_at) VALUES (?, ?)",
+                                            (user_id, now))
+                for role, content in history:
+                    self.connection.execute(
+                        "INSERT INTO history (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                        (user_id, role, content, now))
+                for key, value in user_data.items():
+                    if key not in ("banned", "history"):
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO user_settings (user_id, key, value) VALUES (?, ?, ?)",
+                            (user_id, key, json.dumps(value)))
+                self.connection.execute("INSERT INTO migrated_files (file_name) VALUES (?)", (file_name,))
+            logger.bind(user=user_id).info("User File Migrated")
+
+    @staticmethod
+    def valid_history(file_name, history):
+        """Returns the (role, content) pairs of a user file history, skipping and logging entries that are not chat
+        messages so one malformed file can not stop the bot from starting"""
+        if not isinstance(history, list):
+            logger.bind(file=file_name).warning("User File History Skipped: history is not a list")
+            return []
+        messages = []
+        for index, message in enumerate(history):
+            role = message.get("role", "user") if isinstance(message, dict) else None
+            content = message.get("content", "") if isinstance(message, dict) else None
+            if not isinstance(role, str) or not isinstance(content, str):
+                logger.bind(file=file_name, entry=index).warning("User File History Entry Skipped")
+                continue
+            messages.append((role, content))
+        return messages
+
+    def is_banned(self, user_id):
+        return str(user_id) in self.banned_users
+
+    async def toggle_ban(self, user_id):
+        """Bans the user if they are not banned and unbans them if they are, returning whether they are now banned"""
+        user_id = str(user_id)
+        banned = user_id not in self.banned_users
+        await self.run(self._set_ban, user_id, banned)
+        if banned:
+            self.banned_users.add(user_id)
+        else:
+            self.banned_users.discard(user_id)
+        return banned
+
+    def _set_ban(self, user_id, banned):
+        with self.connection:
+            if banned:
+                self.connection.execute("INSERT OR REPLACE INTO bans (user_id, banned_at) VALUES (?, ?)",
+                                        (user_id, time.time()))
+            else:
+                self.connection.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
+
+    async def add_history(self, user_id, role, content, tokens=0):
+        """Adds a message to a users chat history. Old messages are removed by the chat history summary."""
+        await self.run(self._add_history, str(user_id), role, content, tokens)
+
+    def _add_history(self, user_id, role, content, tokens):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO history (user_id, role, content, created_at, tokens) VALUES (?, ?, ?, ?, ?)",
+                (user_id, role, content, time.time(), tokens))
+
+    async def get_history_rows(self, user_id):
+        """Returns a users chat history as a list of (id, role, content, tokens) tuples, oldest first"""
+        return await self.run(self._get_history_rows, str(user_id))
+
+    def _get_history_rows(self, user_id):
+        return self.connection.execute("SELECT id, role, content, tokens FROM history WHERE user_id = ? ORDER BY id",
+                                       (user_id,)).fetchall()
+
+    async def delete_history_through(self, user_id, last_id):
+        """Deletes a users history up to and including last_id, returning how many messages were deleted"""
+        return await self.run(self._delete_history_through, str(user_id), last_id)
+
+    def _delete_history_through(self, user_id, last_id):
+        with self.connection:
+            cursor = self.connection.execute("DELETE FROM history WHERE user_id = ? AND id <= ?", (user_id, last_id))
+            return cursor.rowcount
+
+    async def clear_history(self, user_id):
+        await self.run(self._clear_history, str(user_id))
+
+    def _clear_history(self, user_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+
+    async def get_user_setting(self, user_id, key, default=None):
+        return await self.run(self._get_user_setting, str(user_id), key, default)
+
+    def _get_user_setting(self, user_id, key, default):
+        row = self.connection.execute("SELECT value FROM user_settings WHERE user_id = ? AND key = ?",
+                                      (user_id, key)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    async def set_user_setting(self, user_id, key, value):
+        await self.run(self._set_user_setting, str(user_id), key, value)
+
+    def _set_user_setting(self, user_id, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO user_settings (user_id, key, value) VALUES (?, ?, ?)",
+                                    (user_id, key, json.dumps(value)))